@@ -1,12 +1,15 @@
 from PyQt6.QtCore import QObject, pyqtSignal, pyqtSlot as Slot, Qt, QPoint, QStringListModel, QModelIndex, QAbstractListModel
+from PyQt6.QtCore import QTimer, QRunnable, QThreadPool
 from PyQt6.QtWidgets import QApplication, QMenu, QTableWidget, QTabWidget, QTableWidgetItem, QLabel, QPushButton, QVBoxLayout, QHBoxLayout, QWidget, QDialog, QLineEdit
 from PyQt6.QtWidgets import QMessageBox, QCompleter, QListWidget, QListWidgetItem, QListView, QCheckBox
 from PyQt6.QtGui import QIntValidator, QDoubleValidator, QAction, QKeyEvent
-from database import DataBase
+from dbworker import DbExecutor
+import time
 
 from Printer import BillPrinter
-from GlobalAccess import LogMsg, GetElevation
+from GlobalAccess import LogMsg, GetElevation, GetConfig
 from Bills import BillTable
+from cart import Cart
 
 class DropDownWindow(QListView):
     def __init__(self, parent=None):
@@ -23,7 +26,12 @@ class DropDownWindow(QListView):
 class IndexedListModel(QAbstractListModel):
     def __init__(self, items=None):
         super().__init__()
-        self.items = items  # Store index with text
+        self.items = items or []  # Store index with text
+
+    def set_items(self, items):
+        self.beginResetModel()
+        self.items = items
+        self.endResetModel()
 
     def rowCount(self, parent=None):
         return len(self.items)
@@ -42,11 +50,49 @@ class IndexedListModel(QAbstractListModel):
 
         return None
     
+class SearchSignals(QObject):
+    finished = pyqtSignal(int, str, list)  # generation, query, product rows
+
+
+class SearchTask(QRunnable):
+    """Looks up a query in the catalog on the thread pool and reports back through signals."""
+    def __init__(self, generation, query, catalog, signals: SearchSignals):
+        super().__init__()
+        self.generation = generation
+        self.query = query
+        self.catalog = catalog
+        self.signals = signals
+
+    def run(self):
+        self.signals.finished.emit(self.generation, self.query, self.catalog.search(self.query))
+
+
 class MyLineEdit(QLineEdit):
     LostFocusSignal = pyqtSignal()
     GainFocusSignal = pyqtSignal()
     def __init__(self, parent=None):
         super(MyLineEdit, self).__init__(parent)
+        # keystroke timing, used to tell a barcode scanner burst from typing
+        self.scan_key_interval = int(GetConfig("scan_key_interval_ms", 30)) / 1000
+        self.scan_min_length = int(GetConfig("scan_min_length", 4))
+        self.last_key_time = 0
+        self.burst_length = 0
+
+    def keyPressEvent(self, event: QKeyEvent):
+        now = time.monotonic()
+        if event.text() and event.text().isprintable():
+            if now - self.last_key_time > self.scan_key_interval:
+                self.burst_length = 0
+            self.burst_length += 1
+            self.last_key_time = now
+        QLineEdit.keyPressEvent(self, event)
+
+    def is_scan(self):
+        """True if the whole field was typed as one fast burst that has just ended with Enter."""
+        text = self.text()
+        return (len(text) >= self.scan_min_length
+                and self.burst_length >= len(text)
+                and time.monotonic() - self.last_key_time <= self.scan_key_interval * 2)
 
     def focusOutEvent(self, event):
         QLineEdit.focusOutEvent(self, event)
@@ -57,9 +103,9 @@ class MyLineEdit(QLineEdit):
         self.GainFocusSignal.emit()
 
 class BillingTab(QWidget):
-    def __init__(self, db: DataBase, parent=None):
+    def __init__(self, db: DbExecutor, parent=None):
         super(BillingTab, self).__init__(parent)
-        self.db : DataBase = db
+        self.db : DbExecutor = db
 
         self.setFocusPolicy(Qt.FocusPolicy.StrongFocus)
 
@@ -117,12 +163,36 @@ class BillingTab(QWidget):
         
         self.setLayout(bill_layout)
 
+        # The open bill lives in memory, recovered from curr_bill and written back behind the UI
+        self.cart = Cart()
+        # lines can be added before the saved bill comes back, it is merged in and not flushed over until then
+        self.cart_restored = False
+        self.db.call("getCurrentBill", callback=self.restore_cart, errback=self.restore_cart_failed)
+        self.cart_flush_timer = QTimer(self)
+        self.cart_flush_timer.setInterval(int(GetConfig("cart_flush_ms", 2000)))
+        self.cart_flush_timer.timeout.connect(self.flush_cart)
+        self.cart_flush_timer.start()
+
         # Data storage for dropdown selection
-        self.product_data = {}
+        self.product_data = []
+        self.product_data_query = ""
         self.last_added_product_id = None
 
+        # One model reused for every search result
+        self.search_model = IndexedListModel()
+        self.list_widget.setModel(self.search_model)
+
+        # Coalesce bursts of keystrokes into one lookup, run off the GUI thread
+        self.search_generation = 0
+        self.search_signals = SearchSignals()
+        self.search_signals.finished.connect(self.on_search_finished)
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(int(GetConfig("search_debounce_ms", 120)))
+        self.search_timer.timeout.connect(self.update_completer)
+
         # Connect signals
-        self.product_search.textChanged.connect(self.update_completer)
+        self.product_search.textChanged.connect(self.schedule_search)
         self.product_search.GainFocusSignal.connect(self.update_completer)
         self.product_search.LostFocusSignal.connect(self.hide_popup)
 
@@ -136,8 +206,20 @@ class BillingTab(QWidget):
 
         self.update_bill()
 
-    def get_next_bill_id(self):
-        return self.db.getNextBillId()
+    def restore_cart(self, items):
+        if self.cart_restored:
+            return  # cleared with New Bill before the saved bill came back
+        self.cart_restored = True
+        self.cart.merge(items)
+        self.update_bill()
+
+    def restore_cart_failed(self, error):
+        # the saved bill is lost to this session, but the write-behind must not stay off
+        LogMsg(f"Could not restore the open bill : {error}")
+        self.cart_restored = True
+
+    def show_next_bill_id(self, invoice_no):
+        self.invoice_id_label.setText(f"Invoice ID: {invoice_no}")
         
     
     def keyPressEvent(self, event: QKeyEvent):
@@ -165,52 +247,113 @@ class BillingTab(QWidget):
         if self.hasFocus():
             self.list_widget.hide()
 
+    def schedule_search(self):
+        """Restart the debounce timer. Only the last keystroke of a burst triggers a lookup."""
+        self.search_generation += 1  # results of searches already running are now stale
+        if not self.product_search.text():
+            self.search_timer.stop()
+            self.list_widget.hide()
+            return
+        self.search_timer.start()
+
     def update_completer(self):
-        """Fetch matching products from the database and update completer."""
+        """Look up the current search text in the catalog cache on the thread pool."""
+        self.search_timer.stop()
         search_text = self.product_search.text()
         if not search_text:
             self.list_widget.hide()
             return
 
-        # Fetch product details (id, name, price) from the database
-        products = self.db.searchProducts(search_text)  # Returns list of tuples [(id, name, price), ...]
+        self.search_generation += 1
+        QThreadPool.globalInstance().start(SearchTask(self.search_generation, search_text, self.db.catalog, self.search_signals))
 
-        if not products:
-            self.product_data = []
-            self.list_widget.hide()
+    def flush_search(self):
+        """Synchronously bring product_data up to date with the search field, e.g. before Enter is handled."""
+        search_text = self.product_search.text()
+        if not search_text or search_text == self.product_data_query:
+            return
+        self.search_timer.stop()
+        self.search_generation += 1
+        self.show_products(search_text, self.db.catalog.search(search_text))
+
+    def on_search_finished(self, generation, search_text, products):
+        # drop results for queries the user has already typed past
+        if generation != self.search_generation or search_text != self.product_search.text():
+            return
+        if not products and len(search_text.strip()) >= 3:
+            # nothing starts with the text, look for it inside names with the database's substring index
+            self.db.call("searchProducts", search_text,
+                         callback=lambda rows: self.on_substring_search_finished(generation, search_text, rows))
+            return
+        self.show_products(search_text, products)
+
+    def on_substring_search_finished(self, generation, search_text, products):
+        if generation != self.search_generation or search_text != self.product_search.text():
             return
+        self.show_products(search_text, products)
 
-        self.product_data = [(id, name,price) for id, name, hsn, price, stock, unit, tax, desc in products]
+    def show_products(self, search_text, products):
+        self.product_data = [(product[0], product[1], product[3]) for product in products]
+        self.product_data_query = search_text
+        self.search_model.set_items(self.product_data)
 
-        # Update completer model
-        # self.list_widget.setModel(QStringListModel(list(f"{id} - {name} - Rs. {price}/-" for id, name, price, _, _ in products)))
-        self.list_widget.setModel(IndexedListModel(self.product_data))
-        # self.list_widget.clear()
-        # self.list_widget.addItems(list(f"{id} - {name} - Rs. {price}/-" for id, name, price in self.product_data))
+        if not self.product_data:
+            self.list_widget.hide()
+            return
         self.show_popup()
 
     def add_product_to_bill(self, product_id, quantity, override=True):
         """Add the selected product to the bill when Enter is pressed or dropdown is clicked."""
-        # Insert into the bill table
-        self.db.addItemToBill(product_id, quantity, override)
+        product = self.db.catalog.get(int(product_id))
+        if product is None:
+            return LogMsg(f"Product {product_id} not found")
+
+        if override:
+            self.cart.set_quantity(product, quantity)
+            LogMsg(f"Product {product_id} quantity set to: {quantity}")
+        elif product[0] not in self.cart:
+            self.cart.set_quantity(product, quantity)
+            LogMsg(f"Product {product_id} added to bill. Enter quantity")
         self.update_bill()
-        self.last_added_product_id = product_id
+        self.last_added_product_id = product[0]
 
 
     def update_bill(self):
         """Update the bill table with the latest data."""
 
-        self.invoice_id_label.setText(f"Invoice ID: {self.get_next_bill_id()}")
+        self.db.call("getNextBillId", callback=self.show_next_bill_id)
+
+        self.bill_table.show_bill(self.cart.items())
 
-        bill = self.db.getCurrentBill()
-        self.bill_table.show_bill(bill)
+    def flush_cart(self):
+        """Persist the cart to curr_bill if it changed since the last flush."""
+        if self.cart.dirty and self.cart_restored:
+            self.db.call("saveCurrentBill", self.cart.items())
+            self.cart.dirty = False
+
+    def showEvent(self, event):
+        # pick up invoices saved by other terminals while this tab was hidden
+        self.db.call("refreshNextBillId")
+        self.update_bill()
+        return super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.flush_cart()
+        return super().hideEvent(event)
 
     def clear_bill(self):
-        self.db.clearCurrentBill()
+        self.cart_restored = True
+        self.cart.clear()
+        self.db.call("clearCurrentBill")
+        self.cart.dirty = False
         self.update_bill()
 
     def handle_search_enter_pressed(self):
         """Handles pressing Enter on the search field, adding the first dropdown item if available."""
+        if self.product_search.is_scan() and self.handle_scan(self.product_search.text()):
+            return
+
+        self.flush_search()
         if not self.product_data:
             return  # No items in dropdown, do nothing
 
@@ -219,6 +362,21 @@ class BillingTab(QWidget):
         self.add_product_to_bill(product_id=id, quantity=1, override=False)
         self.quantity_input.setFocus()
 
+    def handle_scan(self, code):
+        """Scanner fast path: exact id/barcode lookup, add or increment the line, no popup."""
+        product_id = self.db.catalog.lookup_code(code)
+        if product_id is None:
+            # the product may have just been added on another counter, look again before the next scan
+            self.db.sync_catalog()
+            LogMsg(f"No product with code {code}")
+            return False
+
+        self.cart.add(self.db.catalog.get(product_id))
+        self.update_bill()
+        self.last_added_product_id = product_id
+        self.product_search.clear()  # also cancels the pending search and hides the popup
+        return True
+
     def handle_search_popup_activated(self, index: QModelIndex):
         """Handles selecting an item from the dropdown popup."""
         # id = item.data(Qt.ItemDataRole.UserRole)
@@ -229,6 +387,7 @@ class BillingTab(QWidget):
         self.quantity_input.setFocus()
 
     def handle_quantity_enter_pressed(self):
+        self.flush_search()
         if not self.product_data:
             return
         
@@ -250,8 +409,9 @@ class BillingTab(QWidget):
         self.product_search.clear()
         self.product_search.setFocus()
     
-    def save_bill(self):
-        if not len(self.db.getCurrentBill()):
+    def save_bill(self, on_saved=None):
+        """Confirm and save the cart. on_saved(invoice_no, items) runs once the bill is committed."""
+        if not len(self.cart):
             LogMsg("No items in bill to save")
             return
 
@@ -261,9 +421,7 @@ class BillingTab(QWidget):
                 QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No, QMessageBox.StandardButton.No
             )
             if reply == QMessageBox.StandardButton.Yes:
-                invoice_no = self.db.save_bill()
-                self.update_bill()
-                return invoice_no
+                self.commit_bill(None, on_saved)
         elif self.override_invoice_id_toggle.checkState() == Qt.CheckState.Checked:
             try:
                 override_id = int(self.override_id_input.text())
@@ -271,32 +429,44 @@ class BillingTab(QWidget):
                 LogMsg("Invalid Invoice No.")
                 return
             
-            if self.db.doesInvoiceIdExist(override_id):
-                display_text = "Invoice Id already exists. Are you sure you want to override?"
-            else:
-                display_text = "Are you sure you want to save and print this bill?"
-            
-            reply = QMessageBox.question(
-                self, "Confirm Save", display_text,
-                QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No, QMessageBox.StandardButton.No
-            )
-            if reply == QMessageBox.StandardButton.Yes:
-                invoice_no = self.db.save_bill_override_id(override_id)
-                self.update_bill()
-                return invoice_no
+            self.db.call("doesInvoiceIdExist", override_id,
+                         callback=lambda exists: self.confirm_override_save(override_id, exists, on_saved))
 
+    def confirm_override_save(self, override_id, exists, on_saved):
+        if exists:
+            display_text = "Invoice Id already exists. Are you sure you want to override?"
+        else:
+            display_text = "Are you sure you want to save and print this bill?"
         
+        reply = QMessageBox.question(
+            self, "Confirm Save", display_text,
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No, QMessageBox.StandardButton.No
+        )
+        if reply == QMessageBox.StandardButton.Yes:
+            self.commit_bill(override_id, on_saved)
+
+    def commit_bill(self, override_id, on_saved):
+        items = self.cart.items()
+        self.flush_cart()
+        self.db.call("submit_bill", items, override_id,
+                     callback=lambda invoice_no: self.on_bill_saved(invoice_no, items, on_saved))
+
+    def on_bill_saved(self, invoice_no, items, on_saved):
+        self.update_bill()
+        if invoice_no and on_saved:
+            on_saved(invoice_no, items)
+
     def print_bill(self):
-        invoice_no = self.save_bill()
-        if invoice_no:
-            bill = self.db.getCurrentBill()
-            BillPrinter(invoice_no, self.db.get_bill_date(invoice_no) ,bill).print_bill()
-            # BillPrinter().print_bill(bill)
+        self.save_bill(on_saved=self.print_saved_bill)
+
+    def print_saved_bill(self, invoice_no, bill):
+        self.db.call("get_bill_header", invoice_no,
+                     callback=lambda header: BillPrinter(invoice_no, header[0], bill, invoice_prefix=header[1]).print_bill())
 
         
 if __name__ == "__main__":
-    db = DataBase('database/sql.db')
     app = QApplication([])
+    db = DbExecutor('database/sql.db')
     billing_tab = BillingTab(db)
     
     billing_tab.print_bill()
@@ -1,18 +1,20 @@
-import sys
-import sqlite3
-from PyQt6.QtCore import Qt, QPoint, QDateTime, QTime
-from PyQt6.QtWidgets import QApplication, QWidget, QVBoxLayout, QHBoxLayout, QListWidget, QTableWidget, QTableWidgetItem, QLabel
-from PyQt6.QtWidgets import QListWidgetItem, QMenu, QMessageBox, QCheckBox, QDateTimeEdit
-from PyQt6.QtGui import QAction
-from database import DataBase
+import threading
+from PyQt6.QtCore import Qt, QPoint, QDateTime, QTime, QModelIndex, QObject, pyqtSignal
+from PyQt6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QTableView, QTableWidget, QTableWidgetItem, QLabel
+from PyQt6.QtWidgets import QAbstractItemView, QHeaderView, QMenu, QMessageBox, QCheckBox, QDateTimeEdit
+from PyQt6.QtWidgets import QPushButton, QFileDialog, QProgressDialog
+from dbworker import DbExecutor
+from pagedmodel import PagedTableModel
+from database import BILL_PAGE_SIZE
+from totals import compute_totals, rupees
 
 from Printer import BillPrinter
 from GlobalAccess import LogMsg, GetElevation
 
 class BillTable(QWidget):
-    def __init__(self, db: DataBase, parent=None):
+    def __init__(self, db: DbExecutor, parent=None):
         super().__init__()
-        self.db: DataBase = db
+        self.db: DbExecutor = db
 
         self.bill_table = QTableWidget()
         header_labels = [
@@ -44,30 +46,20 @@ class BillTable(QWidget):
     def show_bill(self, bill):
         """Update the bill table with the latest data."""
 
-        price_total = 0
-        tax_total = 0
+        totals = compute_totals(bill)
         # bill = self.db.getCurrentBill()
-        self.bill_table.setRowCount(len(bill))
-        for row_idx, item in enumerate(bill):
-            id, name, HSN, unit_price, quantity, unit, tax_perc = item
-            self.bill_table.setItem(row_idx, 0, QTableWidgetItem(str(id)))
-            self.bill_table.setItem(row_idx, 1, QTableWidgetItem(str(name)))
-            self.bill_table.setItem(row_idx, 2, QTableWidgetItem(str(HSN)))
-            unit_price_no_tax = unit_price * (100 / (100 + tax_perc))
-
-            self.bill_table.setItem(row_idx, 3, QTableWidgetItem(str(round(unit_price_no_tax, 2))))
-            self.bill_table.setItem(row_idx, 4, QTableWidgetItem(str(quantity)))
-            self.bill_table.setItem(row_idx, 5, QTableWidgetItem(str(unit)))
-            price_no_tax = unit_price_no_tax * quantity
-            self.bill_table.setItem(row_idx, 6, QTableWidgetItem(str(round(price_no_tax, 2))))
-            self.bill_table.setItem(row_idx, 7, QTableWidgetItem(str(tax_perc)))
-            tax_amt = price_no_tax*tax_perc/100
-            self.bill_table.setItem(row_idx, 8, QTableWidgetItem(str(round(tax_amt, 2))))
-            total_amt = unit_price*quantity; 
-            self.bill_table.setItem(row_idx, 9, QTableWidgetItem(str(total_amt)))
-
-            price_total += price_no_tax
-            tax_total += tax_amt
+        self.bill_table.setRowCount(len(totals.lines))
+        for row_idx, line in enumerate(totals.lines):
+            self.bill_table.setItem(row_idx, 0, QTableWidgetItem(str(line.p_id)))
+            self.bill_table.setItem(row_idx, 1, QTableWidgetItem(str(line.name)))
+            self.bill_table.setItem(row_idx, 2, QTableWidgetItem(str(line.hsn)))
+            self.bill_table.setItem(row_idx, 3, QTableWidgetItem(rupees(line.unit_net)))
+            self.bill_table.setItem(row_idx, 4, QTableWidgetItem(str(line.quantity)))
+            self.bill_table.setItem(row_idx, 5, QTableWidgetItem(str(line.unit)))
+            self.bill_table.setItem(row_idx, 6, QTableWidgetItem(rupees(line.net)))
+            self.bill_table.setItem(row_idx, 7, QTableWidgetItem(str(line.tax_perc)))
+            self.bill_table.setItem(row_idx, 8, QTableWidgetItem(rupees(line.tax)))
+            self.bill_table.setItem(row_idx, 9, QTableWidgetItem(rupees(line.gross)))
         
         self.bill_table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
 
@@ -76,20 +68,61 @@ class BillTable(QWidget):
         #         item = self.bill_table.item(row, col)
         #         item.setFlags(item.flags() & ~Qt.ItemFlag.ItemIsEditable)
 
-        grand_total = price_total + tax_total
         self.total_label.setText(
-            f"Price total: {price_total:.2f}    " +
-            f"Tax total: {tax_total:.2f}    " +
-            f"Grand total: {grand_total:.2f}    "
+            f"Price total: {rupees(totals.net)}    " +
+            f"Tax total: {rupees(totals.tax)}    " +
+            f"Grand total: {rupees(totals.gross)}    " +
+            f"Payable: {rupees(totals.payable)}    "
         )
         self.total_label.setAlignment(Qt.AlignmentFlag.AlignRight)
 
 
 
+class BillListModel(PagedTableModel):
+    """
+    Past bills, newest first, loaded one page at a time as the view scrolls.
+    Rows are (bill_id, creator, timestamp, amount) tuples, no widget is created per bill.
+    """
+    headers = ["Invoice", "Date", "Created By", "Amount"]
+    page_query = "get_bills"
+    page_size = BILL_PAGE_SIZE
+
+    def __init__(self, db: DbExecutor, parent=None):
+        super().__init__(db, parent)
+        self.date_range = ()
+
+    def reset(self, date_range=()):
+        self.date_range = date_range
+        super().reset()
+
+    def page_args(self):
+        return self.date_range
+
+    def row_key(self, row):
+        # bills_listing order, (timestamp, bill_id)
+        return row[2], row[0]
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        bill_id, creator, timestamp, amount = self.rows[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return (bill_id, timestamp, creator, f"{amount:.2f}")[index.column()]
+        if role == Qt.ItemDataRole.TextAlignmentRole and index.column() == 3:
+            return Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter
+        if role == Qt.ItemDataRole.UserRole:
+            return bill_id
+        return None
+
+
+class ExportSignals(QObject):
+    progress = pyqtSignal(int, int)  # rows done, total
+
+
 class BillViewer(QWidget):
-    def __init__(self, db: DataBase, parent=None):
+    def __init__(self, db: DbExecutor, parent=None):
         super().__init__()
-        self.db: DataBase = db
+        self.db: DbExecutor = db
         
         layout = QHBoxLayout()
 
@@ -115,12 +148,35 @@ class BillViewer(QWidget):
         self.list_filter_layout.addLayout(endTime)
         self.endDate.dateTimeChanged.connect(self.on_filter_changed)
 
-        self.bill_list = QListWidget()
+        self.bill_model = BillListModel(db, self)
+        self.bill_list = QTableView()
+        self.bill_list.setModel(self.bill_model)
+        self.bill_list.verticalHeader().hide()
+        self.bill_list.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.bill_list.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.bill_list.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
+        self.bill_list.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
         self.bill_list.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
         self.bill_list.customContextMenuRequested.connect(self.show_context_menu)
-        self.bill_list.itemClicked.connect(self.load_bill_items)
+        self.bill_list.clicked.connect(self.load_bill_items)
         self.list_filter_layout.addWidget(self.bill_list)
 
+        self.export_button = QPushButton("Export")
+        export_menu = QMenu(self.export_button)
+        export_menu.addAction("Bills").triggered.connect(lambda: self.export_bills("bills"))
+        export_menu.addAction("Bill Lines").triggered.connect(lambda: self.export_bills("items"))
+        export_menu.addAction("GSTR-1 Tables").triggered.connect(self.export_gstr1)
+        self.export_button.setMenu(export_menu)
+        self.list_filter_layout.addWidget(self.export_button)
+
+        # reprints the selected bills, or after a confirmation the whole listed range when none is selected
+        self.reprint_button = QPushButton("Reprint")
+        reprint_menu = QMenu(self.reprint_button)
+        reprint_menu.addAction("Merged PDF").triggered.connect(lambda: self.reprint_bills(merge=True))
+        reprint_menu.addAction("PDF per Invoice").triggered.connect(lambda: self.reprint_bills(merge=False))
+        self.reprint_button.setMenu(reprint_menu)
+        self.list_filter_layout.addWidget(self.reprint_button)
+
         self.summary_label = QLabel()
         self.list_filter_layout.addWidget(self.summary_label)
         self.summary_table = QTableWidget()
@@ -144,22 +200,83 @@ class BillViewer(QWidget):
         self.load_bills()
     
     def load_bills(self):
+        date_range = self.date_range()
+        self.bill_model.reset(date_range)
+        self.db.call("get_bill_summary", *date_range, callback=self.update_summary_label)
+    
+    def date_range(self):
         if(self.filter_toggle.checkState() == Qt.CheckState.Checked):
-            bills = self.db.get_bills(self.startDate.dateTime(), self.endDate.dateTime())
-            summary = self.db.get_bill_summary(self.startDate.dateTime(), self.endDate.dateTime())
-        else:
-            bills = self.db.get_bills()
-            summary = self.db.get_bill_summary()
+            return (self.startDate.dateTime(), self.endDate.dateTime())
+        return ()
 
-        self.bill_list.clear()
-        
-        for bill_id, username, timestamp in bills:
-            item = QListWidgetItem(f"{bill_id} - {timestamp}")
-            item.setData(Qt.ItemDataRole.UserRole, bill_id)
-            self.bill_list.addItem(item)
+    def export_bills(self, kind):
+        path, _ = QFileDialog.getSaveFileName(
+            self, "Export", "bills.csv" if kind == "bills" else "bill_lines.csv",
+            "CSV (*.csv);;JSON Lines (*.jsonl);;Columnar (*.colz)"
+        )
+        if not path:
+            return
+
+        dialog, progress = self.progress_dialog("Exporting...")
+        self.db.call("export_bills", kind, path, *self.date_range(), progress=progress,
+                     callback=lambda _: (dialog.reset(), dialog.deleteLater()))
+
+    def progress_dialog(self, label):
+        """A cancellable progress dialog and the progress(done, total) callback that drives it from a reader thread."""
+        dialog = QProgressDialog(label, "Cancel", 0, 0, self)
+        dialog.setWindowModality(Qt.WindowModality.WindowModal)
+        dialog.setMinimumDuration(500)
+        cancelled = threading.Event()
+        dialog.canceled.connect(cancelled.set)
+        # progress reaches the dialog through a queued signal
+        signals = ExportSignals(dialog)
+        signals.progress.connect(lambda done, total: (dialog.setMaximum(total), dialog.setValue(done)))
+
+        def progress(done, total):
+            signals.progress.emit(done, total)
+            return not cancelled.is_set()
+
+        return dialog, progress
+
+    def reprint_bills(self, merge):
+        selected = [index.data(Qt.ItemDataRole.UserRole) for index in self.bill_list.selectionModel().selectedRows()]
+        if not selected:
+            listed = "in the listed date range" if self.date_range() else "ever saved"
+            reply = QMessageBox.question(
+                self, "Reprint", f"No invoices are selected. Reprint every invoice {listed}?",
+                QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No, QMessageBox.StandardButton.No
+            )
+            if reply != QMessageBox.StandardButton.Yes:
+                return
+        if merge:
+            path, _ = QFileDialog.getSaveFileName(self, "Reprint", "invoices.pdf", "PDF (*.pdf)")
+        else:
+            path = QFileDialog.getExistingDirectory(self, "Reprint Into Folder")
+        if not path:
+            return
+
+        dialog, progress = self.progress_dialog("Rendering invoices...")
+        self.db.call("reprint_bills", path, *self.date_range(), merge=merge, progress=progress, bill_ids=selected or None,
+                     callback=lambda _: (dialog.reset(), dialog.deleteLater()))
+
+    def export_gstr1(self):
+        folder = QFileDialog.getExistingDirectory(self, "Export GSTR-1 Tables")
+        if folder:
+            self.db.call("export_gstr1", folder, *self.date_range(), callback=self.show_gst_totals)
+
+    def show_gst_totals(self, paths):
+        if paths is None:
+            return
+        self.db.call("get_gst_report", *self.date_range(), callback=lambda report: QMessageBox.information(
+            self, "GSTR-1 Tables",
+            "\n".join(
+                [f"Tax {slab['tax_perc']}%: taxable {slab['taxable_value']:.2f}, CGST {slab['cgst']:.2f}, SGST {slab['sgst']:.2f}"
+                 for slab in report["slabs"]] +
+                [f"\nTotal taxable {report['totals']['taxable_value']:.2f}, CGST {report['totals']['cgst']:.2f}, "
+                 f"SGST {report['totals']['sgst']:.2f}", "", "Written:"] + paths
+            )
+        ))
 
-        self.update_summary_label(summary)
-    
     def update_summary_label(self, summary):
         text = f"<b>Total Sales:</b> ₹{summary['total_price']:.2f}<br><br><b>Products Sold:</b><br>"
         self.summary_label.setText(text)
@@ -171,35 +288,35 @@ class BillViewer(QWidget):
             self.summary_table.setItem(row, 0, QTableWidgetItem(p_name))
             self.summary_table.setItem(row, 1, QTableWidgetItem(str(data['total_quantity'])))
 
-    def load_bill_items(self, item: QListWidgetItem):
-        bill_id = item.data(Qt.ItemDataRole.UserRole)
-        items = self.db.get_bill_items(bill_id)
-        
-        self.bill_table.show_bill(items)
+    def load_bill_items(self, index: QModelIndex):
+        bill_id = index.data(Qt.ItemDataRole.UserRole)
+        self.db.call("get_bill_items", bill_id, callback=self.bill_table.show_bill)
     
     def show_context_menu(self, position: QPoint):
-        item = self.bill_list.itemAt(position)
-        if item:
+        item = self.bill_list.indexAt(position)
+        if item.isValid():
             menu = QMenu(self)
             print_action = menu.addAction("Print")
             delete_action = None
             if GetElevation() == 'admin':
                 delete_action = menu.addAction("Delete")
             
-            action = menu.exec(self.bill_list.mapToGlobal(position))
+            action = menu.exec(self.bill_list.viewport().mapToGlobal(position))
             if action == print_action:
                 self.print_bill(item)
             elif action == delete_action and GetElevation() == 'admin':
                 self.delete_bill(item)
 
-    def print_bill(self, item: QListWidgetItem):
+    def print_bill(self, item: QModelIndex):
         invoice_no = item.data(Qt.ItemDataRole.UserRole)
         if invoice_no:
-            bill = self.db.get_bill_items(invoice_no)
-            BillPrinter(invoice_no, self.db.get_bill_date(invoice_no) ,bill).print_bill()
+            self.db.call("get_bill_items", invoice_no, callback=lambda bill: self.db.call(
+                "get_bill_header", invoice_no,
+                callback=lambda header: BillPrinter(invoice_no, header[0], bill, invoice_prefix=header[1]).print_bill()
+            ))
 
 
-    def delete_bill(self, item: QListWidgetItem):
+    def delete_bill(self, item: QModelIndex):
         bill_id = item.data(Qt.ItemDataRole.UserRole)
         
         reply = QMessageBox.question(
@@ -209,7 +326,9 @@ class BillViewer(QWidget):
         )
 
         if reply == QMessageBox.StandardButton.Yes:
-            self.db.delete_bill(bill_id)
-            self.load_bills()
-            self.db.reset_invoice_no()
+            self.db.call("delete_bill", bill_id, callback=lambda deleted: self.on_bill_deleted(bill_id, deleted))
+
+    def on_bill_deleted(self, bill_id, deleted):
+        self.load_bills()
+        if deleted:
             LogMsg(f"Deleted Bill with invoice No: {bill_id} deleted successfully.")
@@ -1,4 +1,5 @@
 from PyQt6.QtCore import QObject, pyqtSignal, QDateTime
+import threading
 
 class GlobalData(QObject):
     status_msg = pyqtSignal(str)  # Signal carrying an error message
@@ -18,6 +19,7 @@ class GlobalData(QObject):
 
         # create log file if not exists
         self.log_file = open("log.txt", "a")
+        self.log_lock = threading.Lock()  # the database worker threads log too
 
     def SetUser(self, username, elevation):
         self.username = username
@@ -27,8 +29,9 @@ class GlobalData(QObject):
         self.status_msg.emit(message)
         # add to log file with timestamp
         timestamp = QDateTime.currentDateTime().toString()
-        self.log_file.write(f"{timestamp} : {message}\n")
-        self.log_file.flush()
+        with self.log_lock:
+            self.log_file.write(f"{timestamp} : {message}\n")
+            self.log_file.flush()
 
 def LogMsg(message:str):
     GlobalData.I().Log(message)
@@ -41,6 +44,7 @@ def GetUser():
 
 import os
 import sys
+import json
 from pathlib import Path
 
 
@@ -53,4 +57,18 @@ def resource_path(relative_path):
         # If we are still in dev mode, make our paths start from the folder this file is in
         base_path = Path(__file__).parent
 
-    return os.path.join(base_path, relative_path)
\ No newline at end of file
+    return os.path.join(base_path, relative_path)
+
+_config = None
+
+def GetConfig(key, default=None):
+    """Read a value from config.json. The file is loaded once per process."""
+    global _config
+    if _config is None:
+        try:
+            with open(resource_path("config.json"), "r", encoding="utf-8") as f:
+                _config = json.load(f)
+        except Exception as exc:
+            LogMsg(f"Could not read config.json, using defaults: {exc}")
+            _config = {}
+    return _config.get(key, default)
@@ -1,54 +1,157 @@
+import io
 import os
+import sys
+import time
 import tempfile
-import platform
-import json
+from functools import lru_cache
+from reportlab import rl_config
 from reportlab.lib.pagesizes import A4, LETTER
 from reportlab.pdfgen import canvas
-from reportlab.lib.utils import simpleSplit
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.utils import simpleSplit, ImageReader
 from reportlab.pdfbase.pdfmetrics import stringWidth
 from reportlab.lib.colors import Color
-from reportlab.platypus import Paragraph
-from GlobalAccess import resource_path, LogMsg
+from GlobalAccess import resource_path, LogMsg, GetConfig
+from totals import compute_totals, rupees
+from spooler import PrintSpooler
 from datetime import datetime
 
-import subprocess
-def run_win_cmd(cmd):
-    result = []
-    process = subprocess.Popen(cmd,
-                               shell=True,
-                               stdout=subprocess.PIPE,
-                               stderr=subprocess.PIPE)
-    for line in process.stdout:
-        result.append(line)
-    errcode = process.returncode
-    # for line in result:
-    #     print(line)
-    if errcode is not None:
-        raise Exception('cmd %s failed, see above for details', cmd)
-    
+
+# bills go straight to the printer, so skip the 7-bit ASCII85 pass over image streams (the slowest step of a render)
+rl_config.useA85 = 0
+
+# layout of one bill copy, in the rotated half sheet. y runs from 842 at the top edge down to 247 at the bottom edge
+ITEMS_TOP = 742      # below the invoice line and the column headings
+ITEMS_BOTTOM = 262   # lowest baseline a row may use
+NAME_WIDTH = 56      # the item column, HSN starts at 80
+NAME_LEADING = 8
+CARRY_HEIGHT = 16    # rule and carried forward row closing a continued page
+TOTALS_HEIGHT = 76   # rule, total row, CGST, SGST, round off and grand total closing the last page
+
+
+HEADER_WIDTH = LETTER[1]/2 - 40  # points
+HEADER_HEIGHT = 50
+
+# header_dpi: resample the header image to the printer's resolution, None keeps the full size file
+# page_compression: deflate the page content streams, None leaves it to ReportLab's default
+PDF_PROFILES = {
+    "standard": {"header_dpi": None, "page_compression": None},
+    "compact": {"header_dpi": 200, "page_compression": True},
+}
+
+
+def GetPdfProfile():
+    name = GetConfig("pdf_profile", "standard")
+    if name not in PDF_PROFILES:
+        LogMsg(f"Unknown pdf_profile '{name}', using standard")
+        name = "standard"
+    return PDF_PROFILES[name]
+
+
+@lru_cache(maxsize=None)
+def header_image(dpi=None):
+    """header.png, decoded once per process, and scaled to dpi at the printed size when given."""
+    if dpi is None:
+        image = ImageReader(resource_path("header.png"))
+    else:
+        from PIL import Image
+        with Image.open(resource_path("header.png")) as source:
+            size = (round(HEADER_WIDTH / 72 * dpi), round(HEADER_HEIGHT / 72 * dpi))
+            # same RGB conversion drawImage applies to the full size file
+            image = ImageReader(source.convert("RGB").resize(size, Image.Resampling.LANCZOS))
+    image.getRGBData()  # decode now, drawImage fingerprints the pixels on every use
+    return image
+
+
+def draw_bill_header(c: canvas.Canvas, has_tax, dpi=None):
+    """
+    Header image and column headings of one bill copy, as a form drawn once per document and placed per copy,
+    so the image is embedded a single time however many copies and pages use it.
+    Returns the form name.
+    """
+    name = ("billHeaderTax" if has_tax else "billHeader") + (str(dpi) if dpi else "")
+    if c.hasForm(name):
+        return name
+    c.beginForm(name)
+    c.drawImage(header_image(dpi), 10, 780, width=HEADER_WIDTH, height=HEADER_HEIGHT)
+    y_position = 760 - 12
+    c.setFont("Helvetica-Bold", 8)
+    c.drawString(20, y_position, "Item")
+    c.drawString(80, y_position, "HSN")
+    c.drawRightString(150, y_position, "Rate")
+    c.drawString(160, y_position, "Quantity")
+    c.drawString(200, y_position, "Unit")
+    if has_tax:
+        c.drawRightString(270, y_position, "Price")
+        c.drawRightString(310, y_position, "GST %")
+        c.drawRightString(360, y_position, "GST Amt.")
+    c.drawRightString(400, y_position, "Amt.")
+    c.endForm()
+    return name
+
+
 class BillPrinter:
-    def __init__(self, invoice_no, date_time, bill_items):
-        self.output_filename = "bill.pdf"
+    def __init__(self, invoice_no, date_time, bill_items, profile=None, invoice_prefix=None):
+        self.output_filename = os.path.join(tempfile.gettempdir(), "bill.pdf")
         self.invoice_no = invoice_no
         self.date_time = date_time
         self.bill_items = bill_items
-        self.invoice_prefix = self._load_invoice_prefix()
+        self.totals = compute_totals(bill_items)
+        self.pages = None
+        self.profile = PDF_PROFILES[profile] if profile else GetPdfProfile()
+        # the prefix stored with the bill, the configured one for bills that are not saved
+        self.invoice_prefix = invoice_prefix or self._load_invoice_prefix()
 
     def _load_invoice_prefix(self):
-        try:
-            config_path = resource_path("config.json")
-            with open(config_path, "r", encoding="utf-8") as f:
-                config = json.load(f)
-            prefix = config.get("invoice_prefix", "A")
-            return prefix if isinstance(prefix, str) and prefix else "A"
-        except Exception as exc:
-            LogMsg(f"Falling back to default invoice prefix: {exc}")
-            return ""
+        prefix = GetConfig("invoice_prefix", "A")
+        return prefix if isinstance(prefix, str) and prefix else "A"
     
-    def draw_bill(self, c : canvas.Canvas, x_offset, y_offset):
+    def paginate(self):
+        """
+        Measure every row once and split the bill into pages.
+        Returns [(rows, carried)]: rows are (LineTotals, wrapped name lines) and carried the (net, tax, gross)
+        paise of the lines on earlier pages.
+        """
+        if self.pages is not None:
+            return self.pages
+        pages = [[]]
+        y_position = ITEMS_TOP
+        for line in self.totals.lines:
+            name_lines = simpleSplit(str(line.name), "Helvetica", 8, NAME_WIDTH) or [""]
+            height = NAME_LEADING * len(name_lines) + 2
+            if pages[-1] and y_position - height < ITEMS_BOTTOM + CARRY_HEIGHT:
+                pages.append([])
+                y_position = ITEMS_TOP - 12  # brought forward row
+            pages[-1].append((line, name_lines))
+            y_position -= height
+        # the totals need more room than the carried forward row, take the last row along if they do not fit
+        if y_position < ITEMS_BOTTOM + TOTALS_HEIGHT and len(pages[-1]) > 1:
+            pages.append([pages[-1].pop()])
+
+        self.pages = []
+        carried = (0, 0, 0)
+        for rows in pages:
+            self.pages.append((rows, carried))
+            carried = tuple(total + sum(getattr(line, column) for line, _ in rows)
+                            for total, column in zip(carried, ("net", "tax", "gross")))
+        return self.pages
+
+    def draw_subtotal(self, c, x_offset, y_position, label, subtotal):
+        net, tax, gross = subtotal
+        c.setFont("Helvetica-Bold", 8)
+        c.drawString(x_offset + 20, y_position, label)
+        if self.totals.has_tax:
+            c.drawRightString(x_offset + 270, y_position, rupees(net))
+            c.drawRightString(x_offset + 360, y_position, rupees(tax))
+        c.drawRightString(x_offset + 400, y_position, rupees(gross))
+
+    def draw_bill(self, c : canvas.Canvas, x_offset, y_offset, page_no=0):
+        """One copy of page page_no of the bill."""
         width, height = LETTER
-        has_tax = any(item[6] != 0 for item in self.bill_items)
+        totals = self.totals
+        has_tax = totals.has_tax
+        pages = self.paginate()
+        rows, carried = pages[page_no]
+        last_page = page_no == len(pages) - 1
         
         # # Add heading
         # c.setFont("Helvetica-Bold", 16)
@@ -58,174 +161,154 @@ class BillPrinter:
         # c.setFont("Helvetica", 12)
         # c.drawString(x_offset + 20, y_offset + height - 40, "Bill Receipt")
         
-        # Add Bill Receipt title image
-        c.drawImage(resource_path("header.png"), x_offset+10, y_offset+780, width=height/2-40, height=50)
+        # Add Bill Receipt title image and table headings, repeated on every page
+        c.saveState()
+        c.translate(x_offset, y_offset)
+        c.doForm(draw_bill_header(c, has_tax, self.profile["header_dpi"]))
+        c.restoreState()
         y_position = y_offset + 760
 
         # Add Invoice No. and Date
         c.setFont("Helvetica", 10)
         c.drawString(x_offset + 20, y_position, f"Invoice No.: {self.invoice_prefix}{self.invoice_no:03d}")
+        if len(pages) > 1:
+            c.drawCentredString(x_offset + 210, y_position, f"Page {page_no + 1} of {len(pages)}")
         c.drawRightString(x_offset + 400, y_position, f"Date: {self.date_time.strftime('%d-%m-%y %H:%M')}")
-        y_position -= 12
+        y_position -= 18  # column headings are part of the header form
 
-        # table headings
-        c.setFont("Helvetica-Bold", 8)
-        c.drawString(x_offset + 20, y_position, "Item")
-        c.drawString(x_offset + 80, y_position, "HSN")
-        c.drawRightString(x_offset + 150, y_position, "Rate")
-        c.drawString(x_offset + 160, y_position, "Quantity")
-        c.drawString(x_offset + 200, y_position, "Unit")
-        if has_tax:
-            c.drawRightString(x_offset + 270, y_position, "Price")
-            c.drawRightString(x_offset + 310, y_position, "GST %")
-            c.drawRightString(x_offset + 360, y_position, "GST Amt.")
-        c.drawRightString(x_offset + 400, y_position, "Amt.")
-        y_position -= 6
+        if page_no:
+            y_position -= 8
+            self.draw_subtotal(c, x_offset, y_position, "Brought forward:", carried)
+            y_position -= 4
 
         # items
         c.setFont("Helvetica", 8)
-        total_amount = 0
-        tax_amount = 0
-        grand_total = 0
-        for id, name, HSN, unit_price, quantity, unit, tax_perc in self.bill_items:
-            price = unit_price * quantity
-            if has_tax:
-                unit_price_no_tax = unit_price * (100 / (tax_perc + 100)) if tax_perc else unit_price
-                price_no_tax = unit_price_no_tax * quantity
-                tax = price_no_tax * tax_perc / 100 if tax_perc else 0
-                total_amount += price_no_tax
-                tax_amount += tax
-            grand_total += price
-            
-            # Wrap text for name
-            # wrapped_name = textwrap.wrap(name, wrap_width)
-            # name_lines = len(wrapped_name)
-            name_style = ParagraphStyle(
-                'NameStyle',
-                fontName='Helvetica',
-                fontSize=8,
-                textColor=Color(0.3, 0.3, 0.3),
-                leading=8  # Adjust line spacing if needed
-            )
-            p = Paragraph(name, name_style)
-            p.wrapOn(c, 80, 20)
-            y_position -= p.height
-            p.drawOn(c, x_offset+20, y_position)
-
-            # for i, line in enumerate(wrapped_name):
-            #     c.drawString(x_offset + 20, y_position - (i * 12), line)
-
-            c.drawString(x_offset + 80, y_position, str(HSN))
-            c.drawRightString(x_offset + 150, y_position, f"{unit_price:.2f}")
-            c.drawString(x_offset + 160, y_position, str(quantity))
-            c.drawString(x_offset + 200, y_position, unit)
+        for line, name_lines in rows:
+            # the values sit on the baseline of the last name line
+            y_position -= NAME_LEADING * len(name_lines)
+            for i, text in enumerate(name_lines):
+                c.drawString(x_offset + 20, y_position + (len(name_lines) - 1 - i) * NAME_LEADING, text)
+
+            c.drawString(x_offset + 80, y_position, str(line.hsn))
+            c.drawRightString(x_offset + 150, y_position, rupees(line.unit_price))
+            c.drawString(x_offset + 160, y_position, str(line.quantity))
+            c.drawString(x_offset + 200, y_position, line.unit)
             if has_tax:
-                c.drawRightString(x_offset + 270, y_position, f"{price_no_tax:.2f}")
-                c.drawRightString(x_offset + 310, y_position, f"{tax_perc:.2f}")
-                c.drawRightString(x_offset + 360, y_position, f"{tax:.2f}")
-            c.drawRightString(x_offset + 400, y_position, f"{price:.2f}")
+                c.drawRightString(x_offset + 270, y_position, rupees(line.net))
+                c.drawRightString(x_offset + 310, y_position, f"{line.tax_perc:.2f}")
+                c.drawRightString(x_offset + 360, y_position, rupees(line.tax))
+            c.drawRightString(x_offset + 400, y_position, rupees(line.gross))
             y_position -= 2
         
         y_position -= 2
         
         c.line(x_offset + 20, y_position, x_offset + 400, y_position)
         y_position -= 12
-        c.setFont("Helvetica-Bold", 8)
-        c.drawString(x_offset + 20, y_position, "Total:")
-        if has_tax:
-            c.drawRightString(x_offset + 270, y_position, f"{total_amount:.2f}")
-            c.drawRightString(x_offset + 360, y_position, f"{tax_amount:.2f}")
-        c.drawRightString(x_offset + 400, y_position, f"{grand_total:.2f}")
+        if not last_page:
+            subtotal = tuple(total + sum(getattr(line, column) for line, _ in rows)
+                             for total, column in zip(carried, ("net", "tax", "gross")))
+            self.draw_subtotal(c, x_offset, y_position, "Carried forward:", subtotal)
+            return
+
+        self.draw_subtotal(c, x_offset, y_position, "Total:", (totals.net, totals.tax, totals.gross))
 
         y_position -= 20
 
         c.setFont("Helvetica-Bold", 8)
         if has_tax:
-            half_tax = tax_amount / 2
             prefix = "CGST : Rs. "
-            c.drawString(x_offset + 330 - stringWidth(prefix, "Helvetica-Bold", 8), y_position, prefix + f"{half_tax:.2f}")
+            c.drawString(x_offset + 330 - stringWidth(prefix, "Helvetica-Bold", 8), y_position, prefix + rupees(totals.cgst))
             y_position -= 12
 
             prefix = "SGST : Rs. "
-            c.drawString(x_offset + 330 - stringWidth(prefix, "Helvetica-Bold", 8), y_position, prefix + f"{half_tax:.2f}")
+            c.drawString(x_offset + 330 - stringWidth(prefix, "Helvetica-Bold", 8), y_position, prefix + rupees(totals.sgst))
             y_position -= 12
 
-        total_rounded = round(grand_total)
         prefix = "Round off: Rs. "
-        c.drawString(x_offset + 330 - stringWidth(prefix, "Helvetica-Bold", 8), y_position, prefix + f"{(total_rounded - grand_total):.2f}")
+        c.drawString(x_offset + 330 - stringWidth(prefix, "Helvetica-Bold", 8), y_position, prefix + rupees(totals.round_off))
         y_position -= 12
 
         c.setFont("Helvetica-Bold", 10)
         prefix = "Grand Total: Rs. "
-        c.drawString(x_offset + 330 - stringWidth(prefix, "Helvetica-Bold", 10), y_position, prefix + f"{total_rounded:.2f}")
+        c.drawString(x_offset + 330 - stringWidth(prefix, "Helvetica-Bold", 10), y_position, prefix + rupees(totals.payable))
     
-    def generate_bill_pdf(self):
-        c = canvas.Canvas(self.output_filename, pagesize=A4)
+    def draw_sheets(self, c: canvas.Canvas):
+        """The bill on as many A4 sheets as it needs, two copies of each page per sheet, ending each sheet."""
         width, height = A4
-        # print(width, height)
-        # create color from rgb
-        # RGB values for the color
-        r, g, b = 0.3, 0.3, 0.3
-        color = Color(r, g, b)
-        c.setFillColor(color)
-        c.setStrokeColor(color)
-
-        # Draw two copies of the bill on the same page, splitting the page in half horizontally
-        c.saveState()  # Save current state
-        c.translate(height, 0)  # Move to (x, y) position
-        c.rotate(90)  # Rotate counterclockwise
-        self.draw_bill(c, 0, 0)
-        self.draw_bill(c, height/2, 0)
-        c.restoreState() 
-
-        c.line(0, height/2, width, height/2)
-        
-        c.save()
-        return self.output_filename
+        for page_no in range(len(self.paginate())):
+            # print(width, height)
+            # create color from rgb
+            # RGB values for the color
+            r, g, b = 0.3, 0.3, 0.3
+            color = Color(r, g, b)
+            c.setFillColor(color)
+            c.setStrokeColor(color)
+
+            # Draw two copies of the bill on the same page, splitting the page in half horizontally
+            c.saveState()  # Save current state
+            c.translate(height, 0)  # Move to (x, y) position
+            c.rotate(90)  # Rotate counterclockwise
+            self.draw_bill(c, 0, 0, page_no)
+            self.draw_bill(c, height/2, 0, page_no)
+            c.restoreState() 
+
+            c.line(0, height/2, width, height/2)
+            c.showPage()
+
+    def render(self):
+        """The bill as PDF bytes, rendered in memory."""
+        return render_bills([self])
+
+    def generate_bill_pdf(self, path=None):
+        path = path or self.output_filename
+        with open(path, "wb") as f:
+            f.write(self.render())
+        return path
     
     def print_bill(self):
-        # with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_pdf:
-        #     pdf_filename = temp_pdf.name
-        
-        self.generate_bill_pdf()
-        print(resource_path("bin\\gswin32c.exe"))
-
-        cmd = resource_path("gsprint.exe") + " -ghostscript "+ resource_path("bin\\gswin32c.exe") +" bill.pdf"
-        try:
-            run_win_cmd(cmd)
-            pass
-        except:
-            LogMsg("AutoPrint Failed")
-            try:
-                os.startfile('bill.pdf', "print")
-            except:
-                LogMsg("Bill saved. Could not print bill")
-                try:
-                    os.startfile('bill.pdf')
-                except:
-                    LogMsg("Could not open bill pdf. saved as bill.pdf")
-            
-
-        # import win32print, win32api
-        # GHOSTSCRIPT_PATH = resource_path("bin/gswin32.exe")
-        # GSPRINT_PATH = resource_path("gsprint.exe")
-
-        # # YOU CAN PUT HERE THE NAME OF YOUR SPECIFIC PRINTER INSTEAD OF DEFAULT
-        # try:
-        #     currentprinter = win32print.GetDefaultPrinter()
-        #     print(GHOSTSCRIPT_PATH, GSPRINT_PATH, currentprinter)
-
-        #     cmd = f'"{GHOSTSCRIPT_PATH}" -dPrinted -dBATCH -dNOPAUSE -dFitPage -sDEVICE=mswinpr2 -sOutputFile="%printer%{currentprinter}" "bill.pdf"'
-        #     win32api.ShellExecute(0, 'open', 'cmd.exe', f'/c {cmd}', '.', 0)
-
-        #     # win32api.ShellExecute(0, 'open', GSPRINT_PATH, '-ghostscript "'+GHOSTSCRIPT_PATH+'" -color -printer "'+currentprinter+'" -fit "bill.pdf"', '.', 0)
-        # except:
-        #     LogMsg("Bill saved. Could not print bill")
-        
-        # os.remove(pdf_filename)
+        """Queue the bill on the background print spooler, returns without waiting for the printer."""
+        return PrintSpooler.I().submit(self.invoice_no, self.date_time, self.bill_items, self.invoice_prefix)
+
+
+def render_bills(printers):
+    """Several bills as one PDF in memory, each starting on a new sheet. The header is embedded once for all of them."""
+    buffer = io.BytesIO()
+    profile = printers[0].profile if printers else PDF_PROFILES["standard"]
+    c = canvas.Canvas(buffer, pagesize=A4, pageCompression=profile["page_compression"])
+    for printer in printers:
+        printer.draw_sheets(c)
+    c.save()
+    return buffer.getvalue()
+
+
+def render_benchmark(invoices=50, lines=20):
+    """Render synthetic bills in memory with every profile, print the average ms and size per invoice."""
+    from datetime import datetime
+    bill = [(p_id, f"Benchmark item {p_id} with a longer description", "8471", 10.5 + p_id, 2, "nos", 18) for p_id in range(1, lines + 1)]
+    results = {}
+    for profile in PDF_PROFILES:
+        start = time.perf_counter()
+        BillPrinter(1, datetime.now(), bill, profile).render()
+        first = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        for invoice_no in range(2, invoices + 2):
+            # totals are cached per bill, vary a price so every invoice is computed afresh
+            bill[0] = bill[0][:3] + (10.5 + invoice_no / 100,) + bill[0][4:]
+            size = len(BillPrinter(invoice_no, datetime.now(), bill, profile).render())
+        average = (time.perf_counter() - start) * 1000 / invoices
+        print(f"{profile}, {lines} line bills: first render {first:.1f} ms, then {average:.1f} ms per invoice "
+              f"over {invoices}, {size / 1024:.1f} KB")
+        results[profile] = (average, size)
+    return results
+
 
 # Example Usage
 if __name__ == "__main__":
+    if "--benchmark" in sys.argv:
+        # python Printer.py --benchmark [invoices] [lines]
+        args = [int(arg) for arg in sys.argv[2:4]]
+        render_benchmark(*args)
+        sys.exit(0)
     # bill_data = {
     #     "Item A": {"unit_price": 10.99, "quantity": 2},
     #     "Item B": {"unit_price": 5.49, "quantity": 3},
@@ -1,52 +1,122 @@
-from PyQt6.QtCore import QObject, pyqtSignal as Signal, pyqtSlot as Slot, Qt, QPoint, QStringListModel
-from PyQt6.QtWidgets import QApplication, QMenu, QTableWidget, QTabWidget, QTableWidgetItem, QLabel, QPushButton, QVBoxLayout, QHBoxLayout, QWidget, QDialog, QLineEdit
-from PyQt6.QtWidgets import QMessageBox, QCompleter
+from PyQt6.QtCore import QObject, pyqtSignal as Signal, pyqtSlot as Slot, Qt, QPoint, QStringListModel, QModelIndex, QTimer
+from PyQt6.QtWidgets import QApplication, QMenu, QTableView, QAbstractItemView, QTabWidget, QLabel, QPushButton, QVBoxLayout, QHBoxLayout, QWidget, QDialog, QLineEdit
+from PyQt6.QtWidgets import QMessageBox, QCompleter, QFileDialog
 from PyQt6.QtGui import QIntValidator, QDoubleValidator, QAction
 import sys
 
-from database import DataBase
-from GlobalAccess import GetElevation
+from dbworker import DbExecutor
+from pagedmodel import PagedTableModel
+from database import PRODUCT_PAGE_SIZE
+from GlobalAccess import GetElevation, GetConfig
 
-class ProductTable(QTableWidget):
-    def __init__(self, db, parent = None):
-        super(ProductTable, self).__init__(parent)
-        self.db : DataBase = db
-        self.setColumnCount(8)
-        self.setHorizontalHeaderLabels(["ID", "Name", "HSN", "Price", "Stock", "unit", "tax percentage", "Description"])
+# changes and errors listed in the import confirmation
+IMPORT_PREVIEW_ROWS = 15
+
+class ProductModel(PagedTableModel):
+    """
+    The product table, fetched a page at a time as the view scrolls. Sorting and filtering run in the database.
+    Edits and deletes patch the loaded rows instead of reloading them.
+    """
+    headers = ["ID", "Name", "HSN", "Price", "Stock", "unit", "tax percentage", "Description", "Barcode"]
+    page_query = "get_product_page"
+    page_size = PRODUCT_PAGE_SIZE
+
+    def __init__(self, db: DbExecutor, parent=None):
+        super().__init__(db, parent)
+        self.positions = {}  # p_id -> row index
+        self.sort_column = 0
+        self.descending = False
+        self.filter_text = ""
+        self.editable = GetElevation() == 'admin'
+
+    def page_args(self):
+        return self.sort_column, self.descending, self.filter_text
+
+    def reset(self):
+        self.positions = {}
+        super().reset()
+
+    def set_filter(self, text):
+        self.filter_text = text
+        self.reset()
+
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder):
+        self.sort_column = column
+        self.descending = order == Qt.SortOrder.DescendingOrder
+        self.reset()
+
+    def flags(self, index):
+        flags = super().flags(index)
+        return flags | Qt.ItemFlag.ItemIsEditable if self.editable else flags
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        value = self.rows[index.row()][index.column()]
+        if role in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.EditRole):
+            return "" if value is None else str(value)
+        return None
 
-        self.last_p_id = None
+    def setData(self, index, value, role=Qt.ItemDataRole.EditRole):
+        if role != Qt.ItemDataRole.EditRole or not index.isValid():
+            return False
+        p_id = self.rows[index.row()][0]
+        if str(value) == self.data(index):
+            return False
+        self.db.call("updateProduct", p_id, index.column(), value,
+                     callback=lambda row: self.update_row(p_id, row))
+        return True
 
+    def update_row(self, p_id, row):
+        """Replace the loaded row of p_id with the row written by the database."""
+        if row is None or p_id not in self.positions:
+            return
+        position = self.positions.pop(p_id)
+        self.rows[position] = row
+        self.positions[row[0]] = position
+        self.dataChanged.emit(self.index(position, 0), self.index(position, len(self.headers) - 1))
+
+    def remove_rows(self, product_ids):
+        """Drop deleted products from the loaded rows, one removal per contiguous block."""
+        positions = sorted((self.positions[p_id] for p_id in product_ids if p_id in self.positions), reverse=True)
+        while positions:
+            last = first = positions.pop(0)
+            while positions and positions[0] == first - 1:
+                first = positions.pop(0)
+            self.beginRemoveRows(QModelIndex(), first, last)
+            del self.rows[first:last + 1]
+            self.endRemoveRows()
+        self.positions = {row[0]: i for i, row in enumerate(self.rows)}
+
+    def append_page(self, generation, page):
+        first = len(self.rows)
+        super().append_page(generation, page)
+        for position in range(first, len(self.rows)):
+            self.positions[self.rows[position][0]] = position
+
+
+class ProductTable(QTableView):
+    def __init__(self, db, parent = None):
+        super(ProductTable, self).__init__(parent)
+        self.db : DbExecutor = db
+        self.product_model = ProductModel(db, self)
+        self.setModel(self.product_model)
+        self.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
         if GetElevation() == 'admin':
             self.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
             self.customContextMenuRequested.connect(self.showContextMenu)
+        else:
+            self.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
 
-            self.cellChanged.connect(self.updateProduct)
-            self.cellDoubleClicked.connect(self.saveLastP_id)
-            self.loadProducts()
-    
-    def loadProducts(self):
-        products = self.db.getProducts()  # Assuming db.getProducts() returns a list of tuples
-        self.setRowCount(len(products))
-        if GetElevation() == 'admin' : self.cellChanged.disconnect(self.updateProduct)
-        for row_idx, product in enumerate(products):
-            for col_idx, data in enumerate(product):
-                self.setItem(row_idx, col_idx, QTableWidgetItem(str(data)))
-        if GetElevation() == 'admin': self.cellChanged.connect(self.updateProduct)
-
-        if GetElevation() != 'admin':
-            self.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
-    
-    @Slot(int, int)
-    def updateProduct(self, row, column):
-        new_value = self.item(row, column).text()
-
-        self.db.updateProduct(self.last_p_id, column, new_value)
+        # enabling sorting sorts by the indicator, which loads the first page
+        self.horizontalHeader().setSortIndicator(0, Qt.SortOrder.AscendingOrder)
+        self.setSortingEnabled(True)
 
-        self.loadProducts()
+    def loadProducts(self):
+        self.product_model.reset()
 
-    @Slot(int, int)
-    def saveLastP_id(self, row, column):
-        self.last_p_id = self.item(row, 0).text()
+    def setFilter(self, text):
+        self.product_model.set_filter(text)
 
     @Slot(QPoint)
     def showContextMenu(self, position):
@@ -68,19 +138,14 @@ class ProductTable(QTableWidget):
         )
         
         if reply == QMessageBox.StandardButton.Yes:
-            for row in sorted(selected_rows, reverse=True):
-                product_id = self.item(row, 0).text()
-                self.deleteProduct(product_id)
-
-    def deleteProduct(self, product_id):
-        self.db.deleteProduct(product_id)
-        self.loadProducts()
+            product_ids = [self.product_model.rows[row][0] for row in sorted(selected_rows)]
+            self.db.call("deleteProducts", product_ids, callback=self.product_model.remove_rows)
 
 class ProductForm(QWidget):
     def __init__(self, db, parent=None):
         super(ProductForm, self).__init__(parent)
         
-        self.db : DataBase = db
+        self.db : DbExecutor = db
 
         # Create widgets with labels
         self.id_label = QLabel("Product ID:")
@@ -110,6 +175,9 @@ class ProductForm(QWidget):
 
         self.desc_label = QLabel("Description:")
         self.p_desc = QLineEdit()
+
+        self.barcode_label = QLabel("Barcode:")
+        self.p_barcode = QLineEdit()
         
         self.button = QPushButton("Add Product")
         self.button.clicked.connect(self.AddProduct)
@@ -148,6 +216,10 @@ class ProductForm(QWidget):
         desc_layout.addWidget(self.desc_label)
         desc_layout.addWidget(self.p_desc)
 
+        barcode_layout = QVBoxLayout()
+        barcode_layout.addWidget(self.barcode_label)
+        barcode_layout.addWidget(self.p_barcode)
+
         input_layout.addLayout(id_layout)
         input_layout.addLayout(name_layout)
         input_layout.addLayout(hsn_layout)
@@ -156,6 +228,7 @@ class ProductForm(QWidget):
         input_layout.addLayout(unit_layout)
         input_layout.addLayout(tax_layout)
         input_layout.addLayout(desc_layout)
+        input_layout.addLayout(barcode_layout)
         input_layout.addWidget(self.button)
         
         self.setLayout(input_layout)
@@ -163,7 +236,9 @@ class ProductForm(QWidget):
 
     @Slot()
     def AddProduct(self):
-        self.db.addProduct(
+        tab = self.parent()
+        self.db.call(
+            "addProduct",
             self.p_id.text(), 
             self.p_name.text(), 
             self.p_hsn.text(),
@@ -171,11 +246,11 @@ class ProductForm(QWidget):
             self.p_stock.text(),
             self.p_unit.text(), 
             self.p_tax.text(),
-            self.p_desc.text()
+            self.p_desc.text(),
+            self.p_barcode.text(),
+            callback=lambda _: tab.refresh()
         )
 
-        self.parent().refresh()
-
 class ProductTab(QWidget):
     def __init__(self, db, parent=None):
         super(ProductTab, self).__init__(parent)
@@ -186,12 +261,56 @@ class ProductTab(QWidget):
             self.product_form = ProductForm(db, self)
             self.main_layout.addWidget(self.product_form)
 
+        self.filter_edit = QLineEdit()
+        self.filter_edit.setPlaceholderText("Filter by id, name, HSN or barcode")
+        filter_layout = QHBoxLayout()
+        filter_layout.addWidget(self.filter_edit)
+        if(GetElevation() == 'admin'):
+            self.import_button = QPushButton("Import Price List")
+            self.import_button.clicked.connect(self.importProducts)
+            filter_layout.addWidget(self.import_button)
+        self.main_layout.addLayout(filter_layout)
+
         self.table = ProductTable(db=db)
         self.main_layout.addWidget(self.table)
+
+        # filter once typing pauses, not per keystroke
+        self.filter_timer = QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(int(GetConfig("search_debounce_ms", 120)))
+        self.filter_timer.timeout.connect(lambda: self.table.setFilter(self.filter_edit.text()))
+        self.filter_edit.textChanged.connect(self.filter_timer.start)
         
         self.setLayout(self.main_layout)\
     
     def refresh(self):
         self.table.loadProducts()
 
+    @Slot()
+    def importProducts(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Import Price List", "", "Price lists (*.csv *.xlsx)")
+        if path:
+            # check the whole file first, nothing is written until the changes are confirmed
+            self.db.call("import_products", path, True, callback=lambda report: self.confirmImport(path, report))
+
+    def confirmImport(self, path, report):
+        lines = [f"{report['added']} new, {report['updated']} updated, {report['unchanged']} unchanged products."]
+        for line_no, p_id, change in report["changes"][:IMPORT_PREVIEW_ROWS]:
+            changed = ", ".join(f"{column}: {old} -> {new}" for column, (old, new) in change.items() if old is not None)
+            lines.append(f"line {line_no}: {p_id} " + (changed or "new"))
+        if len(report["changes"]) > IMPORT_PREVIEW_ROWS:
+            lines.append(f"... and {len(report['changes']) - IMPORT_PREVIEW_ROWS} more")
+        if report["errors"]:
+            lines.append(f"\n{len(report['errors'])} rows will be skipped:")
+            lines += [f"line {line_no}: {message}" for line_no, message in report["errors"][:IMPORT_PREVIEW_ROWS]]
+        if not report["changes"]:
+            return QMessageBox.information(self, "Import Price List", "\n".join(lines))
+
+        reply = QMessageBox.question(
+            self, "Import Price List", "\n".join(lines + ["", "Apply these changes?"]),
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No, QMessageBox.StandardButton.No
+        )
+        if reply == QMessageBox.StandardButton.Yes:
+            self.db.call("import_products", path, callback=lambda _: self.refresh())
+
         
\ No newline at end of file
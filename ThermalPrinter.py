@@ -1,11 +1,207 @@
-from escpos.printer import Dummy
+"""
+ESC/POS receipts for thermal printers. A bill goes straight to printer commands, with no PDF or rasterizing.
+Text, totals and the invoice code are drawn by the printer's own fonts and QR/barcode commands.
+"""
+import sys
+import textwrap
 
-# Create a dummy printer instance
-p = Dummy()
+from escpos.printer import Dummy, Network, Serial, Usb
 
-# Print test content
-p.text("Hello, this is a test print!\n")
-p.barcode('123456789012', 'EAN13', 64, 2, '', '')
+from GlobalAccess import GetConfig
+from totals import compute_totals, rupees
 
-# Get the ESC/POS command output
-print(p.output.decode())  # Decoded raw ESC/POS commands
+DEFAULT_THERMAL = {
+    "connection": "network",  # usb, serial or network
+    "host": "192.168.1.100",
+    "port": 9100,
+    "serial_port": "COM3",
+    "baudrate": 9600,
+    "usb_vendor": "0x0416",
+    "usb_product": "0x5011",
+    "profile": "",            # python-escpos printer profile, empty for the generic one
+    "width": 48,              # characters per line, 48 on 80 mm paper, 32 on 58 mm
+    # [field, width] left to right. name width 0 takes what the other columns leave
+    "columns": [["name", 0], ["quantity", 7], ["unit_price", 9], ["gross", 10]],
+    "header_lines": ["J&J Associates"],
+    "footer_lines": ["Thank you, visit again"],
+    "code": "qr",             # qr, barcode or empty for none. encodes the invoice number
+    "cut": True,
+}
+
+# field -> (heading, alignment, text of a LineTotals)
+COLUMNS = {
+    "name": ("Item", "<", lambda line: str(line.name)),
+    "hsn": ("HSN", "<", lambda line: str(line.hsn)),
+    "quantity": ("Qty", ">", lambda line: f"{line.quantity:g}"),
+    "unit": ("Unit", "<", lambda line: str(line.unit)),
+    "unit_price": ("Rate", ">", lambda line: rupees(line.unit_price)),
+    "tax_perc": ("GST%", ">", lambda line: f"{line.tax_perc:g}"),
+    "net": ("Price", ">", lambda line: rupees(line.net)),
+    "tax": ("GST", ">", lambda line: rupees(line.tax)),
+    "gross": ("Amt.", ">", lambda line: rupees(line.gross)),
+}
+
+
+def GetThermalConfig():
+    return {**DEFAULT_THERMAL, **GetConfig("thermal", {})}
+
+
+def column_layout(config):
+    """[(field, width)] with the flexible column sized to fill the line. Raises ValueError if the columns do not fit."""
+    columns = [(field, int(width)) for field, width in config["columns"]]
+    unknown = [field for field, _ in columns if field not in COLUMNS]
+    if unknown:
+        raise ValueError("unknown receipt columns: " + ", ".join(unknown))
+    fixed = sum(width for _, width in columns)
+    # one space between columns
+    rest = config["width"] - fixed - (len(columns) - 1)
+    layout = [(field, width or rest) for field, width in columns]
+    if any(width <= 0 for _, width in layout) or rest < 0:
+        raise ValueError(f"receipt columns do not fit in {config['width']} characters")
+    return layout
+
+
+class ThermalBillPrinter:
+    def __init__(self, invoice_no, date_time, bill_items, config=None, invoice_prefix=None):
+        self.invoice_no = invoice_no
+        self.date_time = date_time
+        self.totals = compute_totals(bill_items)
+        self.config = config or GetThermalConfig()
+        self.width = self.config["width"]
+        self.layout = column_layout(self.config)
+        prefix = invoice_prefix or GetConfig("invoice_prefix", "A")
+        self.invoice_code = f"{prefix if isinstance(prefix, str) and prefix else 'A'}{invoice_no:03d}"
+
+    def _row(self, cells):
+        """Lines of one table row, the text of each column wrapped to its width."""
+        wrapped = [textwrap.wrap(text, width) or [""] for text, (_, width) in zip(cells, self.layout)]
+        lines = []
+        for i in range(max(len(column) for column in wrapped)):
+            lines.append(" ".join(
+                f"{column[i] if i < len(column) else '':{COLUMNS[field][1]}{width}}"
+                for column, (field, width) in zip(wrapped, self.layout)
+            ).rstrip())
+        return lines
+
+    def _amount(self, label, paise):
+        text = rupees(paise)
+        return f"{label}{text:>{self.width - len(label)}}\n"
+
+    def draw(self, p):
+        """Write the receipt to p, any python-escpos printer."""
+        totals = self.totals
+        rule = "-" * self.width + "\n"
+
+        p.set(align="center", bold=True, double_height=True, double_width=True)
+        for line in self.config["header_lines"][:1]:
+            p.text(line + "\n")
+        p.set(align="center", normal_textsize=True)
+        for line in self.config["header_lines"][1:]:
+            p.text(line + "\n")
+
+        p.set(align="left", normal_textsize=True)
+        invoice = f"Invoice No.: {self.invoice_code}"
+        date = f"Date: {self.date_time.strftime('%d-%m-%y %H:%M')}"
+        if len(invoice) + len(date) < self.width:
+            p.text(f"{invoice}{date:>{self.width - len(invoice)}}\n")
+        else:
+            p.text(f"{invoice}\n{date}\n")
+        p.text(rule)
+        p.set(bold=True)
+        p.text("".join(line + "\n" for line in self._row([COLUMNS[field][0] for field, _ in self.layout])))
+        p.set(bold=False)
+        for line in totals.lines:
+            p.text("".join(row + "\n" for row in self._row([COLUMNS[field][2](line) for field, _ in self.layout])))
+        p.text(rule)
+
+        p.text(self._amount("Total:", totals.gross))
+        if totals.has_tax:
+            p.text(self._amount("Taxable value:", totals.net))
+            p.text(self._amount("CGST:", totals.cgst))
+            p.text(self._amount("SGST:", totals.sgst))
+        p.text(self._amount("Round off:", totals.round_off))
+        p.set(bold=True, double_height=True)
+        p.text(self._amount("Grand Total: Rs.", totals.payable))
+        p.set(bold=False, normal_textsize=True)
+
+        p.set(align="center")
+        if self.config["code"] == "qr":
+            # native: the printer draws the code, nothing is rasterized here
+            p.qr(self.invoice_code, size=4, native=True)
+        elif self.config["code"] == "barcode":
+            p.barcode("{B" + self.invoice_code, "CODE128", height=48, width=2, function_type="B")
+
+        for line in self.config["footer_lines"]:
+            p.text(line + "\n")
+        if self.config["cut"]:
+            p.cut()
+
+    def render(self):
+        """The receipt as ESC/POS bytes."""
+        p = Dummy(profile=self.config["profile"] or None)
+        self.draw(p)
+        return p.output
+
+
+def open_printer(config):
+    """The python-escpos printer for the configured connection, opened."""
+    profile = config["profile"] or None
+    if config["connection"] == "usb":
+        printer = Usb(int(str(config["usb_vendor"]), 0), int(str(config["usb_product"]), 0), profile=profile)
+    elif config["connection"] == "serial":
+        printer = Serial(config["serial_port"], baudrate=config["baudrate"], profile=profile)
+    elif config["connection"] == "network":
+        printer = Network(config["host"], config["port"], profile=profile)
+    else:
+        raise ValueError(f"unknown thermal printer connection '{config['connection']}'")
+    printer.open()
+    return printer
+
+
+def send(data, config=None):
+    """Send rendered ESC/POS bytes to the thermal printer."""
+    printer = open_printer(config or GetThermalConfig())
+    try:
+        printer._raw(data)
+    finally:
+        printer.close()
+
+
+# Dummy output of sample_receipt, checked in. python ThermalPrinter.py --check compares a fresh render with it
+GOLDEN_RECEIPT = "thermal_sample.bin"
+
+
+def sample_receipt():
+    """ESC/POS bytes of a fixed bill with the default layout, independent of config.json."""
+    from datetime import datetime
+    sample = [
+        (1, "Copper wire 1.5 sq mm, 90 m coil", "8544", 1450.0, 2, "nos", 18),
+        (2, "Switch 6A", "8536", 38.5, 12, "nos", 18),
+        (3, "Insulation tape", "3919", 25.0, 5, "nos", 0),
+    ]
+    return ThermalBillPrinter(1, datetime(2026, 1, 2, 10, 30), sample, DEFAULT_THERMAL, "A").render()
+
+
+def check_golden(path=GOLDEN_RECEIPT):
+    """True if sample_receipt still renders byte for byte as the golden file, else reports where it differs."""
+    with open(path, "rb") as f:
+        expected = f.read()
+    actual = sample_receipt()
+    if actual == expected:
+        return True
+    offset = next((i for i, (a, b) in enumerate(zip(actual, expected)) if a != b), min(len(actual), len(expected)))
+    print(f"receipt differs from {path} at byte {offset}: {actual[offset:offset + 16]!r} != {expected[offset:offset + 16]!r} "
+          f"({len(actual)} bytes rendered, {len(expected)} expected)")
+    return False
+
+
+if __name__ == "__main__":
+    # python ThermalPrinter.py > receipt.bin writes the sample receipt, the Dummy output the printer would get
+    # python ThermalPrinter.py --check compares it with the golden file, --update-golden rewrites that file
+    if "--check" in sys.argv:
+        sys.exit(0 if check_golden() else 1)
+    if "--update-golden" in sys.argv:
+        with open(GOLDEN_RECEIPT, "wb") as f:
+            f.write(sample_receipt())
+        sys.exit(0)
+    sys.stdout.buffer.write(sample_receipt())
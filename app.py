@@ -3,8 +3,10 @@ from PyQt6.QtWidgets import QApplication, QMenu, QTableWidget, QTabWidget, QTabl
 from PyQt6.QtWidgets import QMessageBox, QCompleter, QMainWindow, QStyleFactory
 from PyQt6.QtGui import QIntValidator, QDoubleValidator, QAction, QKeyEvent, QPalette, QColor
 import sys
+import multiprocessing
 
-from database import DataBase
+from dbworker import DbExecutor
+from spooler import PrintSpooler
 from ProductTable import ProductTab
 from Billing import BillingTab
 from Bills import BillViewer
@@ -105,9 +107,18 @@ if __name__ == '__main__':
     # import os
     # os.environ["QT_QPA_PLATFORM"] = "windows:darkmode=0"
     
-    db = DataBase(resource_path('database/sql.db')) 
-    
+    multiprocessing.freeze_support()  # the print spooler worker is a separate process, also in the frozen build
     app = QApplication([])
+    try:
+        db = DbExecutor(resource_path('database/sql.db'))
+    except RuntimeError as e:
+        QMessageBox.critical(None, "Billing", str(e))
+        sys.exit(1)
+    app.aboutToQuit.connect(db.shutdown)
+    # prints bills left over from the last run
+    PrintSpooler.I().start()
+    app.aboutToQuit.connect(PrintSpooler.I().shutdown)
+
     # set_light_mode(app)
     app.setStyle("Fusion")
     # Create and show the form
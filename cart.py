@@ -0,0 +1,45 @@
+class Cart:
+    """The bill being built at the counter. Edited in memory, written behind to curr_bill for crash recovery."""
+
+    def __init__(self, items=()):
+        # p_id -> (p_id, p_name, HSN, unit_price, quantity, unit, tax_perc), same shape as a curr_bill row
+        self.lines = {item[0]: tuple(item) for item in items}
+        self.dirty = False
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __contains__(self, product_id):
+        return product_id in self.lines
+
+    def items(self):
+        return list(self.lines.values())
+
+    def set_quantity(self, product, quantity):
+        """Set the line for a product row to quantity, removing it at zero."""
+        if quantity == 0:
+            return self.remove(product[0])
+        p_id, p_name, hsn, price, stock, unit, tax_perc = product[:7]
+        self.lines[p_id] = (p_id, p_name, hsn, price, quantity, unit, tax_perc)
+        self.dirty = True
+
+    def add(self, product, quantity=1):
+        """Add quantity to the product's line, creating the line if needed."""
+        line = self.lines.get(product[0])
+        self.set_quantity(product, quantity + (line[4] if line else 0))
+
+    def merge(self, items):
+        """Put curr_bill rows in front of the lines already in the cart, adding up the quantities of shared products."""
+        lines = {item[0]: tuple(item) for item in items}
+        for p_id, line in self.lines.items():
+            restored = lines.get(p_id)
+            lines[p_id] = line[:4] + (restored[4] + line[4],) + line[5:] if restored else line
+        self.lines = lines
+
+    def remove(self, product_id):
+        if self.lines.pop(product_id, None) is not None:
+            self.dirty = True
+
+    def clear(self):
+        self.lines.clear()
+        self.dirty = True
@@ -0,0 +1,101 @@
+import bisect
+import heapq
+import re
+import threading
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+class ProductCatalog:
+    """Process wide in-memory copy of the product table with a sorted prefix index on id and name tokens."""
+
+    _instance = None  # Singleton instance
+
+    @classmethod
+    def I(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.products = {}  # p_id -> product row
+        self.index = []     # sorted (key, p_id), key is the id as text or a lowercase name token
+        self.codes = {}     # id as text or barcode -> p_id, for exact scanner lookups
+        self.change_seq = 0  # last product_changes row applied, see DataBase.sync_catalog
+        self.loaded = False
+
+    @staticmethod
+    def _keys(row):
+        p_id, name = row[0], row[1]
+        keys = {str(p_id)} | set(TOKEN_RE.findall(name.lower()))
+        return [(key, p_id) for key in keys]
+
+    @staticmethod
+    def _codes(row):
+        barcode = row[8] if len(row) > 8 else None
+        return [str(row[0]), barcode] if barcode else [str(row[0])]
+
+    def load(self, products, change_seq=0):
+        with self.lock:
+            self.change_seq = change_seq
+            self.products = {row[0]: row for row in products}
+            self.index = sorted(entry for row in products for entry in self._keys(row))
+            self.codes = {code: row[0] for row in products for code in self._codes(row)}
+            self.loaded = True
+
+    def upsert(self, row):
+        with self.lock:
+            self._drop(row[0])
+            self.products[row[0]] = row
+            for entry in self._keys(row):
+                bisect.insort(self.index, entry)
+            for code in self._codes(row):
+                self.codes[code] = row[0]
+
+    def remove(self, p_id):
+        with self.lock:
+            self._drop(p_id)
+
+    def _drop(self, p_id):
+        row = self.products.pop(p_id, None)
+        if row is None:
+            return
+        for entry in self._keys(row):
+            i = bisect.bisect_left(self.index, entry)
+            if i < len(self.index) and self.index[i] == entry:
+                del self.index[i]
+        for code in self._codes(row):
+            if self.codes.get(code) == p_id:
+                del self.codes[code]
+
+    def get(self, p_id):
+        return self.products.get(p_id)
+
+    def lookup_code(self, code):
+        """Exact match of a scanned code against product ids and barcodes. Returns p_id or None."""
+        return self.codes.get(code.strip())
+
+    def _prefixed(self, term):
+        i = bisect.bisect_left(self.index, (term,))
+        while i < len(self.index) and self.index[i][0].startswith(term):
+            yield self.index[i][1]
+            i += 1
+
+    def search(self, query, limit=50):
+        """Products whose id or name tokens start with every word of query. Exact id first, then name prefix."""
+        terms = TOKEN_RE.findall(query.lower())
+        if not terms:
+            return []
+
+        with self.lock:
+            candidates = None
+            for term in terms:
+                ids = set(self._prefixed(term))
+                candidates = ids if candidates is None else candidates & ids
+                if not candidates:
+                    return []
+            rows = [self.products[p_id] for p_id in candidates]
+
+        q = query.strip().lower()
+        return heapq.nsmallest(limit, rows, key=lambda row: (str(row[0]) != q, not row[1].lower().startswith(q), row[1], row[0]))
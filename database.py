@@ -1,10 +1,46 @@
-from PyQt6.QtCore import QDateTime
 import os
+import sys
 import sqlite3
-from GlobalAccess import LogMsg, GetElevation, GetUser, resource_path
+import time
+from pathlib import Path
+from concurrent.futures import Future
+from GlobalAccess import LogMsg, GetElevation, GetUser, GetConfig, resource_path
 import bcrypt
+from catalog import ProductCatalog
+from migrations import migrate
+from totals import bill_totals, recompute_bill_totals
+import importer
+import exporter
+import gst_report
+import reprint
+
+from datetime import datetime, timedelta
+
+# max rows returned to the billing dropdown
+SEARCH_LIMIT = 50
+# rows fetched per scroll step of the product table
+PRODUCT_PAGE_SIZE = 500
+# products with fewer ledger rows since their last snapshot are not snapshotted yet
+STOCK_SNAPSHOT_MIN_TAIL = 50
+# rows written per executemany when importing a price list
+IMPORT_CHUNK_SIZE = 1000
+# rows fetched per scroll step of the past bills list
+BILL_PAGE_SIZE = 200
+
+# storage settings, overridden by the "storage" section of config.json
+DEFAULT_STORAGE = {
+    "journal_mode": "wal",     # wal lets counters read while another saves. use "delete" for dbs on a network share
+    "synchronous": "normal",
+    "busy_timeout_ms": 5000,
+    "lock_retries": 5,
+    "read_pool_size": 2,
+    "catalog_sync_ms": 1000,   # how often the catalog picks up product changes made by other counters
+}
+
+
+def GetStorageConfig():
+    return {**DEFAULT_STORAGE, **GetConfig("storage", {})}
 
-from datetime import datetime
 
 def print_all_tables_with_entries(db_path):
     """
@@ -57,25 +93,79 @@ def print_all_tables_with_entries(db_path):
 
 
 class DataBase:
-    def __init__(self, db_path):
+    def __init__(self, db_path, read_only=False):
         self.db_path = db_path
-        db_missing = not os.path.exists(db_path)
+        self.read_only = read_only
+        storage = GetStorageConfig()
+        self.lock_retries = int(storage["lock_retries"])
+        busy_timeout = int(storage["busy_timeout_ms"]) / 1000
 
-        # ensure parent directory exists before creating a new db file
-        db_dir = os.path.dirname(db_path)
-        if db_dir:
-            os.makedirs(db_dir, exist_ok=True)
+        if read_only:
+            # the schema is owned by the read-write connection, which must be opened first
+            self.conn = sqlite3.connect(Path(db_path).resolve().as_uri() + "?mode=ro", uri=True, timeout=busy_timeout)
+            self.cursor = self.conn.cursor()
+            self.invoice_prefix = GetConfig("invoice_prefix", "A")
+            self.refreshNextBillId()
+        else:
+            db_missing = not os.path.exists(db_path)
 
-        self.conn = sqlite3.connect(db_path)
-        self.cursor = self.conn.cursor()
-        # turn on foreign key support
-        self.cursor.execute("PRAGMA foreign_keys = ON;")
+            # ensure parent directory exists before creating a new db file
+            db_dir = os.path.dirname(db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
 
-        if db_missing:
-            self.bootstrap()
+            self.conn = sqlite3.connect(db_path, timeout=busy_timeout)
+            self.cursor = self.conn.cursor()
+            # turn on foreign key support
+            self.cursor.execute("PRAGMA foreign_keys = ON;")
+            # journal mode is stored in the file, so only the read-write connection sets it
+            self.cursor.execute(f"PRAGMA journal_mode = {storage['journal_mode']};")
+
+            if db_missing:
+                self.bootstrap()
+
+            migrate(self)
+            self.ensure_invoice_sequence()
+            self.snapshot_stock()
 
         self.cursor.execute("PRAGMA table_info(product)")
-        self.product_columns = [row[1] for row in self.cursor.fetchall()]
+        table_info = self.cursor.fetchall()
+        self.product_columns = [row[1] for row in table_info]
+        # sort keys for the product table, nullable columns order NULL as ''
+        self.product_sort_keys = [name if notnull or pk else f"IFNULL({name}, '')" for _, name, _, notnull, _, pk in table_info]
+
+        self.cursor.execute(f"PRAGMA synchronous = {storage['synchronous']};")
+
+        self.cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'product_fts';")
+        self.has_fts = self.cursor.fetchone() is not None
+
+        # bills waiting for a group commit, see submit_bill
+        self.pending_bills = []
+        self.pending_since = None
+        self.group_commit_ms = int(GetConfig("group_commit_ms", 0))
+
+        # stock ledger rows written since the last snapshot pass
+        self.movements_since_snapshot = 0
+        self.snapshot_every = int(GetConfig("stock_snapshot_every", 5000))
+
+        self.catalog = ProductCatalog.I()
+        if not self.catalog.loaded:
+            # position first, a change made while loading is applied again by the next sync_catalog
+            change_seq = self._product_change_seq()
+            self.catalog.load(self.getProducts(), change_seq)
+
+    def begin_write(self):
+        """BEGIN IMMEDIATE, backing off and retrying while another terminal holds the write lock."""
+        delay = 0.05
+        for attempt in range(self.lock_retries):
+            try:
+                self.cursor.execute("BEGIN IMMEDIATE;")
+                return
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e) or attempt == self.lock_retries - 1:
+                    raise
+                time.sleep(delay)
+                delay = min(delay * 2, 1.0)
 
     def execute_sql_file(self, sql_file):
         try:
@@ -150,7 +240,7 @@ class DataBase:
 
 
 
-    def addProduct(self, product_id, name, hsn, price, stock, unit, tax_perc, desc):
+    def addProduct(self, product_id, name, hsn, price, stock, unit, tax_perc, desc, barcode=""):
         # check if product id exists
         self.cursor.execute(f"SELECT * FROM product WHERE p_id = {product_id};")
         if self.cursor.fetchone():
@@ -163,10 +253,14 @@ class DataBase:
         try: tax_perc = float(tax_perc)
         except: return LogMsg("Invalid tax value")
 
-        insert_query = f"INSERT INTO product VALUES ({product_id}, '{name}', '{hsn}', {price}, {stock}, '{unit}', {tax_perc}, '{desc}');"
+        insert_query = "INSERT INTO product (p_id, p_name, HSN, price, stock, unit, tax_perc, p_desc, barcode) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);"
         try:
-            self.cursor.execute(insert_query)
+            self.cursor.execute(insert_query, (int(product_id), name, hsn, price, stock, unit, tax_perc, desc, barcode.strip() or None))
+            self.cursor.execute(
+                "INSERT INTO stock_movements (p_id, kind, quantity) VALUES (?, 'opening', ?);", (int(product_id), stock)
+            )
             self.conn.commit()
+            self.refresh_catalog([product_id])
             return LogMsg("Product added successfully")
         except Exception as e:
             self.conn.rollback()
@@ -175,18 +269,48 @@ class DataBase:
     def getProducts(self):
         self.cursor.execute("SELECT * FROM product;")
         return self.cursor.fetchall()
-    
+
+    def get_product_page(self, sort_column=0, descending=False, filter_text="", after=None, limit=PRODUCT_PAGE_SIZE):
+        """
+        One page of product rows ordered by product_columns[sort_column], ties broken on p_id.
+        after is the last row already shown, the page continues past it.
+        filter_text matches the id, name, HSN or barcode anywhere.
+        """
+        column = self.product_sort_keys[sort_column]
+        direction, compare = ("DESC", "<") if descending else ("ASC", ">")
+        where = []
+        params = []
+        if filter_text.strip():
+            pattern = "%" + filter_text.strip() + "%"
+            where.append("(CAST(p_id AS TEXT) LIKE ? OR p_name LIKE ? OR HSN LIKE ? OR barcode LIKE ?)")
+            params += [pattern] * 4
+        if after is not None:
+            where.append(f"({column}, p_id) {compare} (?, ?)")
+            params += [after[sort_column] if after[sort_column] is not None else "", after[0]]
+        query = f"""
+            SELECT * FROM product
+            {"WHERE " + " AND ".join(where) if where else ""}
+            ORDER BY {column} {direction}, p_id {direction}
+            LIMIT ?;
+        """
+        self.cursor.execute(query, params + [limit])
+        return self.cursor.fetchall()
+
     def updateProduct(self, product_id, column_idx, new_value):
+        """Set one column of a product. Returns the updated row, or None if the update failed."""
         if(column_idx == 0):
             try:
-                # readd entry with new primary key
-                self.cursor.execute(f"SELECT * FROM product WHERE p_id = {product_id};")
-                product = self.cursor.fetchone()
-                # delete old entry
-                self.cursor.execute(f"DELETE FROM product WHERE p_id = {product_id};")
-                self.cursor.execute(f"INSERT INTO product VALUES ({new_value}, '{product[1]}', {product[2]}, {product[3]}, '{product[4]}');")
+                # move entry to the new primary key, the ledger carries the stock over to the new id
+                self.cursor.execute("UPDATE product SET p_id = ? WHERE p_id = ?;", (int(new_value), int(product_id)))
+                self.cursor.executemany(
+                    "INSERT INTO stock_movements (p_id, kind, quantity, note) SELECT ?, ?, ? * stock, ? FROM product WHERE p_id = ?;",
+                    [(int(product_id), "adjustment", -1, f"renumbered to {new_value}", int(new_value)),
+                     (int(new_value), "opening", 1, f"renumbered from {product_id}", int(new_value))]
+                )
                 self.conn.commit()
-                return LogMsg("Product updated successfully")
+                self.refresh_catalog([product_id, new_value])
+                LogMsg("Product updated successfully")
+                return self.catalog.get(int(new_value))
             except Exception as e:
                 self.conn.rollback()
                 return LogMsg("Updating product failed : " + str(e))
@@ -194,162 +318,627 @@ class DataBase:
         else:
             try:
                 column_name = self.product_columns[column_idx]
-                self.cursor.execute(f"UPDATE product SET {column_name} = '{new_value}' WHERE p_id = {product_id};")
+                if column_name == "stock":
+                    # stock is derived from the ledger, an edit records the difference as an adjustment
+                    self.cursor.execute("""
+                        INSERT INTO stock_movements (p_id, kind, quantity, note)
+                        SELECT p_id, 'adjustment', ? - stock, 'edited' FROM product WHERE p_id = ?;
+                    """, (float(new_value), int(product_id)))
+                else:
+                    self.cursor.execute(f"UPDATE product SET {column_name} = ? WHERE p_id = ?;", (new_value, int(product_id)))
                 self.conn.commit()
-                return LogMsg("Product updated successfully")
+                self.refresh_catalog([product_id])
+                LogMsg("Product updated successfully")
+                return self.catalog.get(int(product_id))
             except Exception as e:
                 self.conn.rollback()
                 return LogMsg("Error updating product: " + str(e))
-    
+
     def deleteProduct(self, product_id):
-        self.cursor.execute(f"DELETE FROM product WHERE p_id = {product_id};")
-        self.conn.commit()
+        return self.deleteProducts([product_id])
+
+    def deleteProducts(self, product_ids):
+        """Delete several products in one transaction. Returns the deleted ids, empty if nothing was deleted."""
+        product_ids = [int(product_id) for product_id in product_ids]
+        try:
+            self.begin_write()
+            # close the ledger of each product at zero, an id can be reused by a later product
+            self.cursor.executemany("""
+                INSERT INTO stock_movements (p_id, kind, quantity, note)
+                SELECT p_id, 'adjustment', -stock, 'product deleted' FROM product WHERE p_id = ?;
+            """, [(product_id,) for product_id in product_ids])
+            self.cursor.executemany("DELETE FROM product WHERE p_id = ?;", [(product_id,) for product_id in product_ids])
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            LogMsg("Error deleting products : " + str(e))
+            return []
+        self.refresh_catalog(product_ids)
         LogMsg("Product(s) deleted successfully")
+        return product_ids
+
+    def _last_move_id(self):
+        self.cursor.execute("SELECT IFNULL(MAX(move_id), 0) FROM stock_movements;")
+        return self.cursor.fetchone()[0]
 
-    def searchProducts(self, search_query):
-        self.cursor.execute(f"SELECT * FROM product WHERE p_name LIKE '%{search_query}%' OR p_id LIKE '%{search_query}%';")
+    def _moved_products(self, after_move_id):
+        # NOT INDEXED keeps this a rowid range, the planner would scan all of stock_movements_product for the DISTINCT
+        self.cursor.execute("SELECT DISTINCT p_id FROM stock_movements NOT INDEXED WHERE move_id > ?;", (after_move_id,))
+        return [row[0] for row in self.cursor.fetchall()]
+
+    def record_stock_movement(self, product_id, quantity, kind="receipt", note=None):
+        """Append a receipt (positive quantity) or adjustment to the stock ledger. Returns the new stock."""
+        try:
+            self.begin_write()
+            self.cursor.execute(
+                "INSERT INTO stock_movements (p_id, kind, quantity, note) VALUES (?, ?, ?, ?);",
+                (int(product_id), kind, float(quantity), note)
+            )
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            return LogMsg("Error recording stock movement : " + str(e))
+        self.movements_since_snapshot += 1
+        self.refresh_catalog([product_id])
+        product = self.catalog.get(int(product_id))
+        return product[4] if product else None
+
+    def snapshot_stock(self, min_tail=STOCK_SNAPSHOT_MIN_TAIL):
+        """
+        Snapshot the stock of products with at least min_tail ledger rows since their last snapshot.
+        Only products moved since the previous pass are looked at, and a new snapshot replaces the older ones.
+        """
+        try:
+            self.begin_write()
+            self.cursor.execute("SELECT move_id FROM stock_snapshot_mark WHERE id = 1;")
+            mark = self.cursor.fetchone()[0]
+            changes = self.conn.total_changes
+            self.cursor.execute("""
+                WITH moved AS (
+                    SELECT DISTINCT p_id FROM stock_movements NOT INDEXED WHERE move_id > :mark
+                ),
+                last AS (
+                    SELECT moved.p_id, s.move_id, s.stock FROM moved
+                    LEFT JOIN stock_snapshots s ON s.p_id = moved.p_id AND s.move_id = (
+                        SELECT MAX(move_id) FROM stock_snapshots WHERE p_id = moved.p_id
+                    )
+                )
+                INSERT INTO stock_snapshots (p_id, move_id, at, stock)
+                SELECT last.p_id, MAX(m.move_id), MAX(m.at), IFNULL(last.stock, 0) + SUM(m.quantity)
+                FROM last
+                JOIN stock_movements m ON m.p_id = last.p_id AND m.move_id > IFNULL(last.move_id, 0)
+                GROUP BY last.p_id
+                HAVING COUNT(*) >= :min_tail;
+            """, {"mark": mark, "min_tail": min_tail})
+            count = self.conn.total_changes - changes
+            # get_stock_at falls back to the ledger for dates before the kept snapshot
+            self.cursor.execute("""
+                DELETE FROM stock_snapshots
+                WHERE p_id IN (SELECT DISTINCT p_id FROM stock_movements NOT INDEXED WHERE move_id > :mark)
+                AND move_id < (SELECT MAX(move_id) FROM stock_snapshots s WHERE s.p_id = stock_snapshots.p_id);
+            """, {"mark": mark})
+            self.cursor.execute(
+                "UPDATE stock_snapshot_mark SET move_id = (SELECT IFNULL(MAX(move_id), 0) FROM stock_movements) WHERE id = 1;"
+            )
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            return LogMsg("Stock snapshot failed : " + str(e))
+        self.movements_since_snapshot = 0
+        if count > 0:
+            LogMsg(f"Stock snapshot taken for {count} products")
+        return count
+
+    def get_stock_at(self, at, product_ids=None):
+        """
+        {p_id: stock} as of the datetime string at, from the latest snapshot before it plus the ledger rows after.
+        product_ids limits the products looked at.
+        """
+        query = """
+            WITH RECURSIVE products(p_id) AS (
+                -- distinct ids by index seeks, without reading the whole ledger
+                SELECT MIN(p_id) FROM stock_movements
+                UNION ALL
+                SELECT (SELECT MIN(p_id) FROM stock_movements WHERE p_id > products.p_id) FROM products WHERE p_id IS NOT NULL
+            )
+            SELECT p.p_id, IFNULL(s.stock, 0) + IFNULL((
+                SELECT SUM(m.quantity) FROM stock_movements m
+                WHERE m.p_id = p.p_id AND m.move_id > IFNULL(s.move_id, 0) AND m.at <= :at
+            ), 0)
+            FROM products p
+            LEFT JOIN stock_snapshots s ON s.p_id = p.p_id AND s.move_id = (
+                SELECT MAX(move_id) FROM stock_snapshots WHERE p_id = p.p_id AND at <= :at
+            )
+            WHERE p.p_id IS NOT NULL
+        """
+        params = {"at": at}
+        if product_ids is not None:
+            query += f" AND p.p_id IN ({', '.join(str(int(p_id)) for p_id in product_ids)})"
+        self.cursor.execute(query + ";", params)
+        return dict(self.cursor.fetchall())
+
+    def get_stock_movements(self, product_id, limit=100):
+        """Latest ledger rows of a product, newest first."""
+        self.cursor.execute("""
+            SELECT move_id, at, kind, quantity, bill_id, note FROM stock_movements
+            WHERE p_id = ? ORDER BY move_id DESC LIMIT ?;
+        """, (int(product_id), limit))
+        return self.cursor.fetchall()
+
+    def check_stock(self, repair=False):
+        """
+        Compare product.stock with the stock derived from the ledger. Returns the ids that differ.
+        With repair, product.stock is reset to the ledger value.
+        """
+        derived = self.get_stock_at("9999-12-31 23:59:59")
+        self.cursor.execute("SELECT p_id, stock FROM product;")
+        mismatched = [p_id for p_id, stock in self.cursor.fetchall() if abs(stock - derived.get(p_id, 0)) > 1e-6]
+        if mismatched:
+            LogMsg(f"stock out of sync with the ledger for {len(mismatched)} products : {mismatched[:20]}")
+        if mismatched and repair:
+            try:
+                self.begin_write()
+                self.cursor.executemany(
+                    "UPDATE product SET stock = ? WHERE p_id = ?;", [(derived.get(p_id, 0), p_id) for p_id in mismatched]
+                )
+                self.conn.commit()
+                self.refresh_catalog(mismatched)
+                LogMsg(f"stock repaired for {len(mismatched)} products")
+            except Exception as e:
+                self.conn.rollback()
+                LogMsg("failed to repair stock : " + str(e))
+        return mismatched
+
+    def import_products(self, path, dry_run=False):
+        """
+        Upsert products from a .csv or .xlsx price list in one transaction.
+        Bad rows are reported and skipped, the rest of the file still imports.
+        Returns {"added", "updated", "unchanged", "errors": [(line_no, message)], "changes": [(line_no, p_id, diff)]}
+        where diff is {column: (old, new)}. With dry_run nothing is written.
+        """
+        report = {"added": 0, "updated": 0, "unchanged": 0, "errors": [], "changes": []}
+        seen = {}     # p_id -> line_no
+        chunk = []    # (line_no, values, diff)
+        written = []
+        statement = None
+        try:
+            if not dry_run:
+                self.begin_write()
+            # diff against what is in the database now, other counters may have changed products
+            self.sync_catalog()
+            for line_no, record in importer.read_rows(path):
+                try:
+                    current = self.catalog.get(importer.product_id(record))
+                    values = importer.validate(record, current, self.product_columns)
+                except ValueError as e:
+                    report["errors"].append((line_no, str(e)))
+                    continue
+                p_id = values["p_id"]
+                if p_id in seen:
+                    report["errors"].append((line_no, f"id {p_id} already imported from line {seen[p_id]}"))
+                    continue
+                seen[p_id] = line_no
+                owner = self.catalog.lookup_code(values["barcode"]) if values.get("barcode") else None
+                if owner not in (None, p_id) and self.catalog.get(owner)[8] == values["barcode"]:
+                    report["errors"].append((line_no, f"barcode {values['barcode']} already belongs to product {owner}"))
+                    continue
+
+                change = importer.diff(values, current, self.product_columns)
+                if not change:
+                    report["unchanged"] += 1
+                    continue
+                if dry_run:
+                    self._count_import(report, line_no, p_id, change, "p_id" in change)
+                    continue
+
+                statement = statement or self._import_statement(list(values))
+                chunk.append((line_no, values, change))
+                if len(chunk) >= IMPORT_CHUNK_SIZE:
+                    written += self._write_import_chunk(statement, chunk, report)
+                    chunk = []
+            if chunk:
+                written += self._write_import_chunk(statement, chunk, report)
+            if not dry_run:
+                self.conn.commit()
+        except Exception as e:
+            if not dry_run:
+                self.conn.rollback()
+            LogMsg("Product import failed : " + str(e))
+            report["errors"].append((0, str(e)))
+            report["added"] = report["updated"] = 0
+            return report
+
+        if written:
+            # a large import is cheaper to reload than to patch row by row
+            if len(written) > IMPORT_CHUNK_SIZE:
+                change_seq = self._product_change_seq()
+                self.catalog.load(self.getProducts(), change_seq)
+            else:
+                self.refresh_catalog(written)
+        LogMsg(
+            f"{'Import check' if dry_run else 'Imported'} {path}: {report['added']} new, {report['updated']} updated, "
+            f"{report['unchanged']} unchanged, {len(report['errors'])} errors"
+        )
+        return report
+
+    def _import_statement(self, columns):
+        """Upsert for rows carrying the given columns. Missing columns only get defaults on insert."""
+        defaults = [column for column in importer.INSERT_DEFAULTS if column not in columns]
+        # stock of an existing product changes through the ledger, see _write_import_chunk
+        updates = ", ".join(f"{column} = excluded.{column}" for column in columns if column not in ("p_id", "stock"))
+        query = f"""
+            INSERT INTO product ({", ".join(columns + defaults)})
+            VALUES ({", ".join("?" * (len(columns) + len(defaults)))})
+            ON CONFLICT(p_id) DO UPDATE SET {updates};
+        """
+        return query, columns, [importer.INSERT_DEFAULTS[column] for column in defaults]
+
+    def _write_import_chunk(self, statement, chunk, report):
+        """executemany one chunk, falling back to row by row to find the rows the database rejects."""
+        query, columns, defaults = statement
+        params = [[values[column] for column in columns] + defaults for _, values, _ in chunk]
+        ids = [values["p_id"] for _, values, _ in chunk]
+        self.cursor.execute(f"SELECT p_id FROM product WHERE p_id IN ({', '.join('?' * len(ids))});", ids)
+        existing = {row[0] for row in self.cursor.fetchall()}
+        self.cursor.execute("SAVEPOINT import_chunk;")
+        try:
+            self.cursor.executemany(query, params)
+            accepted = chunk
+        except sqlite3.Error:
+            self.cursor.execute("ROLLBACK TO import_chunk;")
+            accepted = []
+            for row, row_params in zip(chunk, params):
+                try:
+                    self.cursor.execute(query, row_params)
+                    accepted.append(row)
+                except sqlite3.Error as e:
+                    report["errors"].append((row[0], str(e)))
+        self.cursor.execute("RELEASE import_chunk;")
+        # inserted products got their stock from the upsert. for existing ones the ledger moves the stock
+        # in the database to the imported value, whatever the catalog thought it was
+        self.cursor.executemany(
+            "INSERT INTO stock_movements (p_id, kind, quantity, note) VALUES (?, 'opening', ?, 'price list import');",
+            [(values["p_id"], values["stock"]) for _, values, _ in accepted if values["p_id"] not in existing and "stock" in values]
+        )
+        self.cursor.executemany("""
+            INSERT INTO stock_movements (p_id, kind, quantity, note)
+            SELECT p_id, 'adjustment', :stock - stock, 'price list import' FROM product WHERE p_id = :p_id AND stock <> :stock;
+        """, [
+            {"p_id": values["p_id"], "stock": values["stock"]}
+            for _, values, _ in accepted if values["p_id"] in existing and "stock" in values
+        ])
+        for line_no, values, change in accepted:
+            self._count_import(report, line_no, values["p_id"], change, values["p_id"] not in existing)
+        return [values["p_id"] for _, values, _ in accepted]
+
+    @staticmethod
+    def _count_import(report, line_no, p_id, change, added):
+        report["added" if added else "updated"] += 1
+        report["changes"].append((line_no, p_id, change))
+
+    def refresh_catalog(self, product_ids):
+        """Reload the given products into the in-memory catalog after a write."""
+        for product_id in product_ids:
+            self.cursor.execute("SELECT * FROM product WHERE p_id = ?;", (int(product_id),))
+            row = self.cursor.fetchone()
+            if row:
+                self.catalog.upsert(row)
+            else:
+                self.catalog.remove(int(product_id))
+
+    def _product_change_seq(self):
+        self.cursor.execute("SELECT IFNULL(MAX(seq), 0) FROM product_changes;")
+        return self.cursor.fetchone()[0]
+
+    def sync_catalog(self):
+        """Reload the products changed since the catalog last looked, by this or any other terminal. Returns their ids."""
+        self.cursor.execute("SELECT p_id, seq FROM product_changes WHERE seq > ? ORDER BY seq;", (self.catalog.change_seq,))
+        changes = self.cursor.fetchall()
+        if not changes:
+            return []
+        product_ids = [p_id for p_id, _ in changes]
+        if len(product_ids) > IMPORT_CHUNK_SIZE:
+            self.catalog.load(self.getProducts(), changes[-1][1])
+        else:
+            self.refresh_catalog(product_ids)
+            self.catalog.change_seq = max(self.catalog.change_seq, changes[-1][1])
+        return product_ids
+
+    def searchProducts(self, search_query, limit=SEARCH_LIMIT):
+        """Top `limit` products matching id or name. Exact id first, then name prefix, then substring."""
+        search_query = search_query.strip()
+        if not search_query:
+            return []
+
+        params = {"q": search_query, "limit": limit}
+        rank = "CASE WHEN CAST(p.p_id AS TEXT) = :q THEN 0 WHEN p.p_name LIKE :q || '%' THEN 1 ELSE 2 END"
+        # trigram tokens need at least 3 characters, shorter queries scan
+        if self.has_fts and len(search_query) >= 3:
+            params["match"] = '"' + search_query.replace('"', '""') + '"'
+            query = f"""
+                SELECT p.* FROM product_fts
+                JOIN product p ON p.p_id = product_fts.rowid
+                WHERE product_fts MATCH :match
+                ORDER BY {rank}, product_fts.rank, p.p_name
+                LIMIT :limit;
+            """
+        else:
+            query = f"""
+                SELECT p.* FROM product p
+                WHERE p.p_name LIKE '%' || :q || '%' OR CAST(p.p_id AS TEXT) LIKE '%' || :q || '%'
+                ORDER BY {rank}, p.p_name
+                LIMIT :limit;
+            """
+        self.cursor.execute(query, params)
         return self.cursor.fetchall()
     
     def getCurrentBill(self):
         self.cursor.execute("SELECT * FROM curr_bill;")
         return self.cursor.fetchall()
     
+    def saveCurrentBill(self, items):
+        """Write-behind of the in-memory cart, so an open bill survives a crash."""
+        try:
+            self.begin_write()
+            self.cursor.execute("DELETE FROM curr_bill;")
+            self.cursor.executemany("INSERT INTO curr_bill (p_id, p_name, HSN, unit_price, quantity, unit, tax_perc) VALUES (?, ?, ?, ?, ?, ?, ?);", items)
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            LogMsg("Error saving current bill : " + str(e))
+
     def clearCurrentBill(self):
         self.cursor.execute("DELETE FROM curr_bill;")
         self.conn.commit()
         LogMsg("Bill cleared")
-    
-    def addItemToBill(self, product_id, quantity, override=True):
-        addquery = f"\
-INSERT INTO curr_bill (p_id, p_name, HSN, unit_price, quantity, unit, tax_perc) \
-SELECT {product_id}, p_name, HSN, price, {quantity}, unit, tax_perc \
-FROM product \
-WHERE p_id = {product_id} \
-ON CONFLICT(p_id, p_name) DO UPDATE \
-SET quantity = excluded.quantity \
-;"
-        try:
-            if override:
-                if quantity == 0:
-                    self.removeItemFromBill(product_id)
-                    return
 
-                self.cursor.execute(addquery)
-                self.conn.commit()
-                LogMsg(f"Product {product_id} quantity set to: {quantity}")
-            else:
-                self.cursor.execute(f"SELECT * FROM curr_bill WHERE p_id = {product_id};")
-                item = self.cursor.fetchone()
-                if not item:
-                    self.cursor.execute(addquery)
-                    LogMsg(f"Product {product_id} added to bill. Enter quantity")
-        except Exception as e:
-            return LogMsg("Error adding item to bill : " + str(e))
-        
-
-    def removeItemFromBill(self, id):
-        self.cursor.execute(f"DELETE FROM curr_bill WHERE p_id = {id};")
+    def ensure_invoice_sequence(self):
+        """Add a counter row for the configured prefix, continuing the shared series."""
+        self.invoice_prefix = GetConfig("invoice_prefix", "A")
+        # invoice numbers are also the bills primary key, so every prefix draws from one series
+        self.cursor.execute("""
+            INSERT OR IGNORE INTO invoice_seq (prefix, next_no)
+            SELECT ?, MAX((SELECT IFNULL(MAX(bill_id), 0) + 1 FROM bills), (SELECT IFNULL(MAX(next_no), 0) FROM invoice_seq));
+        """, (self.invoice_prefix,))
         self.conn.commit()
-        LogMsg(f"Product {id} removed form bill")
+        self.refreshNextBillId()
+
+    def refreshNextBillId(self):
+        """Re-read the counter, picking up invoices allocated by other terminals."""
+        self.cursor.execute("SELECT MAX(next_no) FROM invoice_seq;")
+        self.next_invoice_no = self.cursor.fetchone()[0]
+        return self.next_invoice_no
 
     def getNextBillId(self):
-        self.cursor.execute("SELECT IFNULL(MAX(bill_id), 0) + 1 FROM bills;")
-        return self.cursor.fetchone()[0]
+        """Peek at the next invoice no. Served from memory, no query."""
+        return self.next_invoice_no
 
-    def save_bill(self):
-        query = f"\
-BEGIN TRANSACTION;\
-INSERT INTO bills (creator) VALUES ('{GetUser()}');\
-INSERT INTO bill_items (bill_id, p_id, p_name, HSN, unit_price, quantity, unit, tax_perc) \
-SELECT (SELECT last_insert_rowid()), p_id, p_name, HSN, unit_price, quantity, unit, tax_perc FROM curr_bill;\
-UPDATE product \
-SET stock = stock - (SELECT quantity FROM curr_bill WHERE curr_bill.p_id = product.p_id) \
-WHERE p_id IN (SELECT p_id FROM curr_bill); \
-COMMIT;"
-        try:
-            invoice_no = self.getNextBillId()
-            self.cursor.executescript(query)
-            LogMsg("bill saved to database. stock updated")
-            return invoice_no
-        except Exception as e:
-            self.conn.rollback()
-            LogMsg("failed to save bill to database : " + str(e))
+    def _allocate_invoice_no(self):
+        """Take the next invoice no. Must run inside the save transaction."""
+        self.cursor.execute("SELECT MAX(next_no) FROM invoice_seq;")
+        invoice_no = self.cursor.fetchone()[0]
+        # advance every prefix, a counter left behind would hand out a bill_id that is taken
+        self.cursor.execute("UPDATE invoice_seq SET next_no = ?;", (invoice_no + 1,))
+        return invoice_no
+
+    def _insert_bill_items(self, bill_id, items):
+        self.cursor.executemany(
+            "INSERT INTO bill_items (bill_id, p_id, p_name, HSN, unit_price, quantity, unit, tax_perc) VALUES (?, ?, ?, ?, ?, ?, ?, ?);",
+            [(bill_id, *item) for item in items]
+        )
+        self.cursor.executemany(
+            "INSERT INTO stock_movements (p_id, kind, quantity, bill_id) VALUES (?, 'sale', ?, ?);",
+            [(p_id, -quantity, bill_id) for p_id, p_name, HSN, unit_price, quantity, unit, tax_perc in items]
+        )
 
-    def save_bill_override_id(self, bill_id):
-        query = f"\
-BEGIN TRANSACTION;\
-DELETE FROM bills WHERE bill_id = {bill_id};\
-INSERT INTO bills (bill_id, creator) VALUES ({bill_id}, '{GetUser()}');\
-INSERT INTO bill_items (bill_id, p_id, p_name, HSN, unit_price, quantity, unit, tax_perc) \
-SELECT (SELECT last_insert_rowid()), p_id, p_name, HSN, unit_price, quantity, unit, tax_perc FROM curr_bill;\
-UPDATE product \
-SET stock = stock - (SELECT quantity FROM curr_bill WHERE curr_bill.p_id = product.p_id) \
-WHERE p_id IN (SELECT p_id FROM curr_bill); \
-COMMIT;"
+    def _void_bill_items(self, bill_id):
+        """Return the stock of a bill's lines through the ledger. Must run inside a transaction."""
+        self.cursor.execute("""
+            INSERT INTO stock_movements (p_id, kind, quantity, bill_id)
+            SELECT p_id, 'void', quantity, bill_id FROM bill_items WHERE bill_id = ?;
+        """, (bill_id,))
+
+    def _write_bill(self, items, bill_id=None):
+        """Insert one bill. Must run inside a transaction. bill_id None allocates the next invoice no."""
+        if bill_id is None:
+            bill_id = self._allocate_invoice_no()
+        else:
+            self._rollup_bill(bill_id, -1)
+            self._void_bill_items(bill_id)
+            self.cursor.execute("DELETE FROM bills WHERE bill_id = ?;", (bill_id,))
+            # never hand out an id that was taken by an override
+            self.cursor.execute("UPDATE invoice_seq SET next_no = MAX(next_no, ? + 1);", (bill_id,))
+        self.cursor.execute(
+            "INSERT INTO bills (bill_id, invoice_prefix, creator, net_total, tax_total, gross_total, round_off) VALUES (?, ?, ?, ?, ?, ?, ?);",
+            (bill_id, self.invoice_prefix, GetUser(), *bill_totals(items))
+        )
+        self._insert_bill_items(bill_id, items)
+        self._rollup_bill(bill_id, 1)
+        return bill_id
+
+    def _rollup_bill(self, bill_id, sign):
+        """Add (sign 1) or remove (sign -1) a bill's lines in daily_product_sales. Must run inside a transaction."""
+        self.cursor.execute("""
+            INSERT INTO daily_product_sales (day, p_id, p_name, quantity, amount)
+            SELECT date(b.timestamp), bi.p_id, bi.p_name, :sign * bi.quantity, :sign * bi.quantity * bi.unit_price
+            FROM bill_items bi
+            JOIN bills b ON bi.bill_id = b.bill_id
+            WHERE bi.bill_id = :bill_id
+            ON CONFLICT(day, p_id, p_name) DO UPDATE
+            SET quantity = quantity + excluded.quantity, amount = amount + excluded.amount;
+        """, {"bill_id": bill_id, "sign": sign})
+        if sign < 0:
+            # only the keys of this bill can have dropped to zero, seek them rather than scan the rollup
+            self.cursor.execute("""
+                DELETE FROM daily_product_sales
+                WHERE day = (SELECT date(timestamp) FROM bills WHERE bill_id = :bill_id)
+                AND p_id IN (SELECT p_id FROM bill_items WHERE bill_id = :bill_id)
+                AND abs(quantity) < 1e-9 AND abs(amount) < 1e-6;
+            """, {"bill_id": bill_id})
+
+    def save_bills(self, bills):
+        """
+        Save several (items, bill_id) bills under one transaction, so they share a single commit.
+        A bill that fails is rolled back to its savepoint and reported as None without aborting the rest.
+
+        :return: list of invoice nos, in the order of bills.
+        """
+        invoice_nos = []
         try:
-            self.cursor.executescript(query)
-            LogMsg("bill saved to database. stock updated")
-            return bill_id
+            # take the write lock up front so two terminals never allocate the same number
+            self.begin_write()
+            first_move = self._last_move_id()
+            moved = 0  # ledger rows of the bills that were kept
+            for items, bill_id in bills:
+                self.cursor.execute("SAVEPOINT bill;")
+                try:
+                    invoice_nos.append(self._write_bill(items, bill_id))
+                    self.cursor.execute("RELEASE bill;")
+                    moved += len(items)
+                except sqlite3.Error as e:
+                    self.cursor.execute("ROLLBACK TO bill;")
+                    self.cursor.execute("RELEASE bill;")
+                    invoice_nos.append(None)
+                    LogMsg("failed to save bill to database : " + str(e))
+            self.conn.commit()
         except Exception as e:
             self.conn.rollback()
             LogMsg("failed to save bill to database : " + str(e))
+            return [None] * len(bills)
 
-    def doesInvoiceIdExist(self, bill_id: int):
-        query = f"SELECT timestamp FROM bills WHERE bill_id = {bill_id};"
-        if self.cursor.fetchone() is None:
-            return False
-        else:
-            return True
+        self.movements_since_snapshot += moved
+        self.refreshNextBillId()
+        # includes the lines of overridden bills, whose stock came back
+        self.refresh_catalog(self._moved_products(first_move))
+        LogMsg("bill saved to database. stock updated")
+        if self.movements_since_snapshot >= self.snapshot_every:
+            self.snapshot_stock()
+        return invoice_nos
+
+    def save_bill(self, items):
+        """Save the cart as a new bill. Returns the invoice no."""
+        return self.save_bills([(items, None)])[0]
+
+    def save_bill_override_id(self, bill_id, items):
+        return self.save_bills([(items, bill_id)])[0]
+
+    def submit_bill(self, items, bill_id=None):
+        """
+        Queue a bill for saving and return a Future with its invoice no.
+        With group_commit_ms set, bills submitted within that window are saved by one save_bills call
+        once the database worker reaches group_commit_deadline and calls flush_bills.
+        """
+        future = Future()
+        if not self.pending_bills:
+            self.pending_since = time.monotonic()
+        self.pending_bills.append((items, bill_id, future))
+        if self.group_commit_ms <= 0:
+            self.flush_bills()
+        return future
+
+    def group_commit_deadline(self):
+        """Monotonic time by which queued bills must be flushed, None if nothing is queued."""
+        if not self.pending_bills:
+            return None
+        return self.pending_since + self.group_commit_ms / 1000
+
+    def flush_bills(self):
+        pending, self.pending_bills = self.pending_bills, []
+        if not pending:
+            return
+        invoice_nos = self.save_bills([(items, bill_id) for items, bill_id, future in pending])
+        for (items, bill_id, future), invoice_no in zip(pending, invoice_nos):
+            future.set_result(invoice_no)
 
+    def doesInvoiceIdExist(self, bill_id: int):
+        self.cursor.execute("SELECT 1 FROM bills WHERE bill_id = ?;", (bill_id,))
+        return self.cursor.fetchone() is not None
 
     def get_bill_date(self, bill_id):
         self.cursor.execute(f"SELECT timestamp FROM bills WHERE bill_id = {bill_id};")
         timestamp_str = self.cursor.fetchone()[0]
         return datetime.strptime(timestamp_str, "%Y-%m-%d %H:%M:%S")
 
-    def get_bills(self, start_datetime=None, end_datetime=None):
-        if start_datetime is None:
-            start_datetime = QDateTime.fromString("1970-01-01 00:00:00", "yyyy-MM-dd HH:mm:ss")
-        if end_datetime is None:
-            end_datetime = QDateTime.fromString("9999-12-31 23:59:59", "yyyy-MM-dd HH:mm:ss")   
-        query = """
-            SELECT * FROM bills
-            WHERE timestamp BETWEEN ? AND ?
-            ORDER BY timestamp DESC;
-        """
-        self.cursor.execute(query, (start_datetime.toString("yyyy-MM-dd HH:mm:ss"), end_datetime.toString("yyyy-MM-dd HH:mm:ss")))
-        return self.cursor.fetchall()
+    def get_bill_header(self, bill_id):
+        """(date_time, invoice_prefix) of a bill, what the printers need besides its items."""
+        self.cursor.execute("SELECT timestamp, invoice_prefix FROM bills WHERE bill_id = ?;", (bill_id,))
+        timestamp_str, invoice_prefix = self.cursor.fetchone()
+        return datetime.strptime(timestamp_str, "%Y-%m-%d %H:%M:%S"), invoice_prefix
 
-    def get_bill_summary(self, start_datetime=None, end_datetime=None):
-        if start_datetime is None:
-            start_datetime = QDateTime.fromString("1970-01-01 00:00:00", "yyyy-MM-dd HH:mm:ss")
-        if end_datetime is None:
-            end_datetime = QDateTime.fromString("9999-12-31 23:59:59", "yyyy-MM-dd HH:mm:ss")
+    @staticmethod
+    def _date_range(start_datetime=None, end_datetime=None):
+        """'yyyy-MM-dd HH:mm:ss' bounds of an optional QDateTime range, a missing bound is open."""
+        start = "1970-01-01 00:00:00" if start_datetime is None else start_datetime.toString("yyyy-MM-dd HH:mm:ss")
+        end = "9999-12-31 23:59:59" if end_datetime is None else end_datetime.toString("yyyy-MM-dd HH:mm:ss")
+        return start, end
+
+    def get_bills(self, start_datetime=None, end_datetime=None, after=None, limit=BILL_PAGE_SIZE):
+        """
+        One page of (bill_id, creator, timestamp, amount), newest first.
+        after is the (timestamp, bill_id) of the last row already shown, the page continues below it.
+        """
+        start, end = self._date_range(start_datetime, end_datetime)
+        if after is None:
+            after = ("9999-12-31 23:59:59", sys.maxsize)
+        # keyset pagination, walks bills_listing backwards from the previous page without an OFFSET
         query = """
-            SELECT 
-                bi.p_id,
-                bi.p_name,
-                SUM(bi.quantity) AS total_quantity,
-                SUM(bi.quantity * bi.unit_price) AS total_price_per_product
-            FROM bill_items bi
-            JOIN bills b ON bi.bill_id = b.bill_id
-            WHERE b.timestamp BETWEEN ? AND ?
-            GROUP BY bi.p_id, bi.p_name
+            SELECT bill_id, creator, timestamp, gross_total + round_off FROM bills
+            WHERE timestamp BETWEEN ? AND ? AND (timestamp, bill_id) < (?, ?)
+            ORDER BY timestamp DESC, bill_id DESC
+            LIMIT ?;
         """
         self.cursor.execute(query, (
-            start_datetime.toString("yyyy-MM-dd HH:mm:ss"), 
-            end_datetime.toString("yyyy-MM-dd HH:mm:ss")
+            start, end, *after, limit
         ))
-        products = self.cursor.fetchall()
+        return self.cursor.fetchall()
+
+    def get_bill_summary(self, start_datetime=None, end_datetime=None):
+        start, end = self._date_range(start_datetime, end_datetime)
+        start_day = datetime.strptime(start, "%Y-%m-%d %H:%M:%S").date()
+        end_day = datetime.strptime(end, "%Y-%m-%d %H:%M:%S").date()
+
+        # whole days come from the daily rollup, only partial first and last days read bill_items
+        first_full_day = start_day if start.endswith("00:00:00") else start_day + timedelta(days=1)
+        last_full_day = end_day if end.endswith("23:59:59") else end_day - timedelta(days=1)
+
+        products = []
+        if first_full_day > last_full_day:
+            edges = [(start, end)]
+        else:
+            self.cursor.execute("""
+                SELECT p_id, p_name, SUM(quantity), SUM(amount)
+                FROM daily_product_sales
+                WHERE day BETWEEN ? AND ?
+                GROUP BY p_id, p_name
+            """, (first_full_day.isoformat(), last_full_day.isoformat()))
+            products += self.cursor.fetchall()
+            edges = []
+            if first_full_day != start_day:
+                edges.append((start, f"{start_day.isoformat()} 23:59:59"))
+            if last_full_day != end_day:
+                edges.append((f"{end_day.isoformat()} 00:00:00", end))
+
+        for edge_start, edge_end in edges:
+            self.cursor.execute("""
+                SELECT 
+                    bi.p_id,
+                    bi.p_name,
+                    SUM(bi.quantity) AS total_quantity,
+                    SUM(bi.quantity * bi.unit_price) AS total_price_per_product
+                FROM bill_items bi
+                JOIN bills b ON bi.bill_id = b.bill_id
+                WHERE b.timestamp BETWEEN ? AND ?
+                GROUP BY bi.p_id, bi.p_name
+            """, (edge_start, edge_end))
+            products += self.cursor.fetchall()
 
         total_price = 0
         product_summary = {}
 
         for p_id, p_name, total_quantity, total_price_per_product in products:
-            product_summary[(p_id, p_name)] = {
-                "total_quantity": total_quantity,
-                "total_price": total_price_per_product
-            }
+            summary = product_summary.setdefault((p_id, p_name), {"total_quantity": 0, "total_price": 0})
+            summary["total_quantity"] += total_quantity
+            summary["total_price"] += total_price_per_product
             total_price += total_price_per_product
 
         return {
@@ -359,24 +948,116 @@ COMMIT;"
 
 
 
-    def get_bills_summary(self):
-        self.cursor.execute()
+    def export_bills(self, kind, path, start_datetime=None, end_datetime=None, progress=None):
+        """Stream bills or bill lines (kind "bills" or "items") in a date range to path. See exporter.export."""
+        start, end = self._date_range(start_datetime, end_datetime)
+        try:
+            count = exporter.export(
+                self.conn, kind, path,
+                start, end,
+                progress
+            )
+        except Exception as e:
+            LogMsg("Export failed : " + str(e))
+            return None
+        LogMsg(f"Exported {count} {'bills' if kind == 'bills' else 'bill lines'} to {path}")
+        return count
+
+    def reprint_bills(self, path, start_datetime=None, end_datetime=None, first_id=None, last_id=None, merge=True, progress=None,
+                      bill_ids=None):
+        """
+        Render the invoices in a date and/or bill id range, or the ones in bill_ids, to one merged PDF or a folder of PDFs.
+        See reprint.reprint.
+        """
+        start, end = self._date_range(start_datetime, end_datetime)
+        try:
+            count, size = reprint.reprint(
+                self.conn, path,
+                start, end,
+                first_id or 0, last_id or sys.maxsize, merge, progress, bill_ids=bill_ids
+            )
+        except Exception as e:
+            LogMsg("Reprint failed : " + str(e))
+            return None
+        LogMsg(f"Reprinted {count} invoices to {path}, {size / 1024:.0f} KB" + (f", {size / count / 1024:.1f} KB per invoice" if count else ""))
+        return count
+
+    def get_gst_report(self, start_datetime=None, end_datetime=None):
+        """HSN-wise and slab-wise taxable value, CGST and SGST for a date range. See gst_report.build_report."""
+        start, end = self._date_range(start_datetime, end_datetime)
+        return gst_report.build_report(
+            self.cursor, start, end
+        )
+
+    def export_gstr1(self, folder, start_datetime=None, end_datetime=None):
+        """Write the GSTR-1 hsn, b2cs and docs tables for a date range into folder."""
+        try:
+            paths = gst_report.export_gstr1(self.get_gst_report(start_datetime, end_datetime), folder, self.invoice_prefix)
+        except Exception as e:
+            LogMsg("GSTR-1 export failed : " + str(e))
+            return None
+        LogMsg(f"GSTR-1 tables written to {folder}")
+        return paths
+
+    def get_bills_summary(self, start_datetime=None, end_datetime=None):
+        """Invoice count and summed stored totals over a date range."""
+        start, end = self._date_range(start_datetime, end_datetime)
+        self.cursor.execute("""
+            SELECT COUNT(*), IFNULL(SUM(net_total), 0), IFNULL(SUM(tax_total), 0),
+                   IFNULL(SUM(gross_total), 0), IFNULL(SUM(round_off), 0)
+            FROM bills
+            WHERE timestamp BETWEEN ? AND ?;
+        """, (start, end))
+        count, net, tax, gross, round_off = self.cursor.fetchone()
+        return {"count": count, "net_total": net, "tax_total": tax, "gross_total": gross, "round_off": round_off}
+
+    def check_bill_totals(self, repair=False):
+        """
+        Compare the totals stored on bills with bill_items. Returns the ids that differ.
+        With repair, the stored totals are rewritten from bill_items.
+        """
+        expected = recompute_bill_totals(self.cursor)
+        self.cursor.execute("SELECT bill_id, net_total, tax_total, gross_total, round_off FROM bills;")
+        mismatched = [
+            bill_id for bill_id, *stored in self.cursor.fetchall()
+            if any(abs(a - b) > 0.005 for a, b in zip(stored, expected.get(bill_id, (0, 0, 0, 0))))
+        ]
+        if mismatched:
+            LogMsg(f"bill totals out of sync for {len(mismatched)} bills : {mismatched[:20]}")
+        if mismatched and repair:
+            try:
+                self.begin_write()
+                self.cursor.executemany(
+                    "UPDATE bills SET net_total = ?, tax_total = ?, gross_total = ?, round_off = ? WHERE bill_id = ?;",
+                    [(*expected.get(bill_id, (0, 0, 0, 0)), bill_id) for bill_id in mismatched]
+                )
+                self.conn.commit()
+                LogMsg(f"bill totals repaired for {len(mismatched)} bills")
+            except Exception as e:
+                self.conn.rollback()
+                LogMsg("failed to repair bill totals : " + str(e))
+        return mismatched
     
     def get_bill_items(self, bill_id):
         self.cursor.execute(f"SELECT p_id, p_name, HSN, unit_price, quantity, unit, tax_perc FROM bill_items WHERE bill_id = {bill_id};")
         return self.cursor.fetchall()
     
     def delete_bill(self, bill_id):
-        query = f"\
-BEGIN TRANSACTION;\
-UPDATE product \
-SET stock = stock + (SELECT quantity FROM bill_items WHERE bill_id = {bill_id} AND bill_items.p_id = product.p_id) \
-WHERE p_id IN (SELECT p_id FROM bill_items WHERE bill_id = {bill_id}); \
-DELETE FROM bill_items WHERE bill_id = {bill_id};\
-DELETE FROM bills WHERE bill_id = {bill_id};\
-COMMIT;"
         try:
-            self.cursor.executescript(query)
+            product_ids = [item[0] for item in self.get_bill_items(bill_id)]
+            self.begin_write()
+            self._void_bill_items(bill_id)
+            self._rollup_bill(bill_id, -1)
+            self.cursor.execute("DELETE FROM bill_items WHERE bill_id = ?;", (bill_id,))
+            self.cursor.execute("DELETE FROM bills WHERE bill_id = ?;", (bill_id,))
+            # hand the number back if this was the last invoice
+            self.cursor.execute(
+                "UPDATE invoice_seq SET next_no = (SELECT IFNULL(MAX(bill_id), 0) + 1 FROM bills) WHERE next_no = ? + 1;",
+                (bill_id,)
+            )
+            self.conn.commit()
+            self.refresh_catalog(product_ids)
+            self.refreshNextBillId()
             LogMsg("bill deleted from database. stock updated")
             return True
         except Exception as e:
@@ -401,12 +1082,16 @@ COMMIT;"
     def get_curr_date(self):
         self.cursor.execute("SELECT datetime('now', 'localtime');")
         return self.cursor.fetchone()[0]
-    
-    def reset_invoice_no(self):
-        self.cursor.execute("DELETE FROM sqlite_sequence WHERE name='bills'")
-        self.conn.commit()
+
 
 if __name__ == '__main__':
+    if "--check-totals" in sys.argv:
+        db = DataBase('database/sql.db')
+        sys.exit(1 if db.check_bill_totals(repair="--repair" in sys.argv) else 0)
+    if "--check-stock" in sys.argv:
+        db = DataBase('database/sql.db')
+        sys.exit(1 if db.check_stock(repair="--repair" in sys.argv) else 0)
+
     # # Execute the SQL script
     # execute_sql_file('database/billing.sql')
     # # Print the schema of the database
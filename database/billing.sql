@@ -2,10 +2,6 @@
 
 -- select * from product;
 
-select SUM(amt) from
-(
-select bill_id, timestamp, SUM(quantity * unit_price) as amt
-from bills natural join bill_items 
+select SUM(gross_total + round_off) from bills
 -- WHERE strftime('%Y-%m', timestamp) = '2025-05'
-group by bill_id
-) as cbills;
\ No newline at end of file
+;
\ No newline at end of file
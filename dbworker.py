@@ -0,0 +1,180 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from PyQt6.QtCore import QObject, QTimer, pyqtSignal
+
+from catalog import ProductCatalog
+from database import DataBase, GetStorageConfig
+from GlobalAccess import GlobalData, LogMsg
+
+# DataBase methods that only read. They run on the read-only pool so they never wait behind a save.
+READ_METHODS = {
+    "get_user_data",
+    "get_users",
+    "getProducts",
+    "get_product_page",
+    "searchProducts",
+    "sync_catalog",
+    "getCurrentBill",
+    "doesInvoiceIdExist",
+    "get_bill_date",
+    "get_bill_header",
+    "get_bills",
+    "get_bill_summary",
+    "get_bill_items",
+    "get_gst_report",
+    "get_stock_at",
+    "get_stock_movements",
+    "get_curr_date",
+}
+
+# long read-only jobs. They run on their own thread and connection so they never hold up the read pool.
+BATCH_METHODS = {
+    "export_bills",
+    "export_gstr1",
+    "reprint_bills",
+}
+
+
+class DbWorker(threading.Thread):
+    """Owns one DataBase connection and runs method calls from its job queue on it, one at a time.
+    Several workers may share a queue to form a pool."""
+
+    def __init__(self, name, factory, jobs):
+        super().__init__(name=name, daemon=True)
+        self.factory = factory
+        self.jobs = jobs
+        self.ready = threading.Event()
+        self.db = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.db = self.factory()
+        except Exception as e:
+            self.error = e
+            LogMsg(f"Could not open database : {e}")
+        finally:
+            self.ready.set()
+
+        if self.db is None:
+            # no connection, fail every job that arrives so no caller waits forever
+            while (job := self.jobs.get()) is not None:
+                job[3].set_exception(self.error)
+            return
+
+        while True:
+            # with bills waiting for a group commit, only wait for more work until they are due
+            deadline = self.db.group_commit_deadline()
+            try:
+                job = self.jobs.get(timeout=None if deadline is None else max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                self.db.flush_bills()
+                continue
+
+            if job is None:
+                self.db.flush_bills()
+                break
+
+            method, args, kwargs, future = job
+            try:
+                result = getattr(self.db, method)(*args, **kwargs)
+            except Exception as e:
+                future.set_exception(e)
+                continue
+
+            if isinstance(result, Future):
+                # queued work such as submit_bill, resolved on a later flush
+                result.add_done_callback(lambda f, future=future: future.set_result(f.result()))
+            else:
+                future.set_result(result)
+
+        self.db.conn.close()
+
+
+class DbExecutor(QObject):
+    """
+    Runs DataBase calls off the GUI thread.
+    Writes are serialized on one thread owning the read-write connection, reads are spread over a pool of
+    threads with read-only connections and batch jobs queue on one more read-only thread.
+    Callbacks are delivered on the GUI thread.
+    """
+    _done = pyqtSignal(object, object)  # (callback, errback), future
+
+    def __init__(self, db_path, parent=None):
+        super().__init__(parent)
+        GlobalData.I()  # create the log singleton on the GUI thread before any worker logs
+        self._done.connect(self._run_callback)
+
+        self.write_jobs = queue.Queue()
+        self.writer = DbWorker("db-writer", lambda: DataBase(db_path), self.write_jobs)
+        self.writer.start()
+        # the writer bootstraps the schema and loads the catalog, readers must not open before that
+        self.writer.ready.wait()
+        if self.writer.db is None:
+            self.write_jobs.put(None)
+            raise RuntimeError(f"Could not open database {db_path} : {self.writer.error}")
+
+        self.read_jobs = queue.Queue()
+        self.readers = [
+            DbWorker(f"db-reader-{i}", lambda: DataBase(db_path, read_only=True), self.read_jobs)
+            for i in range(max(1, int(GetStorageConfig()["read_pool_size"])))
+        ]
+        for reader in self.readers:
+            reader.start()
+
+        self.batch_jobs = queue.Queue()
+        self.batch = DbWorker("db-batch", lambda: DataBase(db_path, read_only=True), self.batch_jobs)
+        self.batch.start()
+
+        self.catalog = ProductCatalog.I()
+        # the catalog only sees this process's writes, poll for what the other counters changed
+        self.catalog_sync = None
+        self.catalog_sync_timer = QTimer(self)
+        self.catalog_sync_timer.setInterval(int(GetStorageConfig()["catalog_sync_ms"]))
+        self.catalog_sync_timer.timeout.connect(self.sync_catalog)
+        self.catalog_sync_timer.start()
+
+    def sync_catalog(self):
+        """Queue a catalog refresh on the read pool, unless one is still running."""
+        if self.catalog_sync is None or self.catalog_sync.done():
+            self.catalog_sync = self.call("sync_catalog")
+
+    def call(self, method, *args, callback=None, errback=None, **kwargs):
+        """
+        Queue DataBase.method(*args). Returns a Future.
+        callback(result), or errback(exception) if the method raised, runs on the GUI thread.
+        """
+        future = Future()
+        if method in BATCH_METHODS:
+            jobs = self.batch_jobs
+        elif method in READ_METHODS:
+            jobs = self.read_jobs
+        else:
+            jobs = self.write_jobs
+        jobs.put((method, args, kwargs, future))
+        if callback is not None or errback is not None:
+            future.add_done_callback(lambda f: self._done.emit((callback, errback), f))
+        return future
+
+    def _run_callback(self, callbacks, future):
+        callback, errback = callbacks
+        if future.exception() is not None:
+            LogMsg(f"Database error : {future.exception()}")
+            if errback is not None:
+                errback(future.exception())
+            return
+        if callback is not None:
+            callback(future.result())
+
+    def shutdown(self):
+        """Finish queued work and close every connection."""
+        self.catalog_sync_timer.stop()
+        for reader in self.readers:
+            self.read_jobs.put(None)
+        self.batch_jobs.put(None)
+        self.write_jobs.put(None)
+        for worker in self.readers + [self.batch, self.writer]:
+            worker.join()
@@ -0,0 +1,130 @@
+"""
+Streaming export of bills and bill lines for a date range.
+Rows move from the cursor to the file in fixed size batches, so memory stays flat however long the range is.
+
+Formats, picked from the file extension:
+    .csv    header row and one line per row
+    .jsonl  one JSON object per row
+    .colz   columnar: a JSON header line, then one zlib compressed block per batch holding each column as a list.
+            Read back with read_columnar.
+"""
+import csv
+import json
+import os
+import struct
+import sys
+import zlib
+
+EXPORT_BATCH_SIZE = 5000
+COLUMNAR_MAGIC = b"BILLCOL1\n"
+
+EXPORT_QUERIES = {
+    "bills": """
+        SELECT bill_id, timestamp, creator, net_total, tax_total, gross_total, round_off
+        FROM bills
+        WHERE timestamp BETWEEN ? AND ?
+        ORDER BY timestamp, bill_id
+    """,
+    "items": """
+        SELECT b.bill_id, b.timestamp, bi.p_id, bi.p_name, bi.HSN, bi.unit_price, bi.quantity, bi.unit, bi.tax_perc,
+               bi.quantity * bi.unit_price AS amount
+        FROM bills b
+        JOIN bill_items bi ON bi.bill_id = b.bill_id
+        WHERE b.timestamp BETWEEN ? AND ?
+        ORDER BY b.timestamp, b.bill_id
+    """,
+}
+
+COUNT_QUERIES = {
+    "bills": "SELECT COUNT(*) FROM bills WHERE timestamp BETWEEN ? AND ?",
+    "items": "SELECT COUNT(*) FROM bills b JOIN bill_items bi ON bi.bill_id = b.bill_id WHERE b.timestamp BETWEEN ? AND ?",
+}
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+def iter_batches(cursor, size=EXPORT_BATCH_SIZE):
+    while True:
+        batch = cursor.fetchmany(size)
+        if not batch:
+            return
+        yield batch
+
+
+def write_csv(f, columns, batches):
+    writer = csv.writer(f)
+    writer.writerow(columns)
+    for batch in batches:
+        writer.writerows(batch)
+        yield len(batch)
+
+
+def write_jsonl(f, columns, batches):
+    for batch in batches:
+        f.writelines(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in batch)
+        yield len(batch)
+
+
+def write_columnar(f, columns, batches):
+    f.write(COLUMNAR_MAGIC)
+    f.write(json.dumps({"columns": columns}).encode() + b"\n")
+    for batch in batches:
+        block = zlib.compress(json.dumps([list(column) for column in zip(*batch)], ensure_ascii=False).encode())
+        f.write(struct.pack("<II", len(batch), len(block)))
+        f.write(block)
+        yield len(batch)
+
+
+def read_columnar(path):
+    """Yield ({column: [values]}, rows) per block of a .colz export."""
+    with open(path, "rb") as f:
+        if f.readline() != COLUMNAR_MAGIC:
+            raise ValueError(f"{path} is not a columnar export")
+        columns = json.loads(f.readline())["columns"]
+        while header := f.read(8):
+            rows, size = struct.unpack("<II", header)
+            yield dict(zip(columns, json.loads(zlib.decompress(f.read(size))))), rows
+
+
+WRITERS = {".csv": (write_csv, "w"), ".jsonl": (write_jsonl, "w"), ".colz": (write_columnar, "wb")}
+
+
+def export(conn, kind, path, start, end, progress=None, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Write the bills or bill lines (kind "bills" or "items") with timestamps in [start, end] to path.
+    progress(done, total) is called after every batch; returning False cancels, removing the partial file.
+    Returns the number of rows written.
+    """
+    writer, mode = WRITERS[os.path.splitext(path)[1].lower()]
+    cursor = conn.cursor()
+    cursor.execute(COUNT_QUERIES[kind], (start, end))
+    total = cursor.fetchone()[0]
+    cursor.execute(EXPORT_QUERIES[kind], (start, end))
+    columns = [description[0] for description in cursor.description]
+
+    done = 0
+    try:
+        with open(path, mode, **({"newline": "", "encoding": "utf-8"} if mode == "w" else {})) as f:
+            for written in writer(f, columns, iter_batches(cursor, batch_size)):
+                done += written
+                if progress is not None and progress(done, total) is False:
+                    raise ExportCancelled(f"export cancelled after {done} of {total} rows")
+    except BaseException:
+        cursor.close()
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    cursor.close()
+    return done
+
+
+if __name__ == '__main__':
+    # python exporter.py items 2025-04-01 2026-03-31 out.csv
+    import sqlite3
+    kind, start_day, end_day, out_path = sys.argv[1:5]
+    conn = sqlite3.connect("file:database/sql.db?mode=ro", uri=True)
+    count = export(conn, kind, out_path, f"{start_day} 00:00:00", f"{end_day} 23:59:59",
+                   progress=lambda done, total: print(f"\r{done}/{total}", end="", flush=True))
+    print(f"\n{count} rows written to {out_path}")
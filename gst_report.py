@@ -0,0 +1,161 @@
+"""
+GST return figures for a period: HSN-wise and tax slab-wise totals with the CGST/SGST split,
+plus GSTR-1 style CSV tables (hsn, b2cs, docs) for the offline utility.
+Prices in bill_items include tax, taxable value is backed out per line in paise by totals, as on the printed invoice.
+"""
+import csv
+import os
+import threading
+from collections import OrderedDict
+
+import totals
+from GlobalAccess import GetConfig
+
+# single grouped pass over the period's lines, money summed in integer paise
+HSN_QUERY = """
+    SELECT
+        bi.HSN,
+        bi.unit,
+        bi.tax_perc,
+        MIN(bi.p_name),
+        SUM(bi.quantity),
+        SUM(line_gross_paise(bi.unit_price, bi.quantity)),
+        SUM(line_net_paise(bi.unit_price, bi.quantity, bi.tax_perc))
+    FROM bills b
+    JOIN bill_items bi ON bi.bill_id = b.bill_id
+    WHERE b.timestamp BETWEEN ? AND ?
+    GROUP BY bi.HSN, bi.unit, bi.tax_perc
+    ORDER BY bi.HSN, bi.tax_perc
+"""
+
+# invoice series of the period, also the cache fingerprint: any save, override or delete in range changes it
+DOCUMENTS_QUERY = """
+    SELECT COUNT(*), MIN(bill_id), MAX(bill_id), IFNULL(SUM(bill_id), 0), IFNULL(SUM(gross_total), 0), MAX(timestamp)
+    FROM bills
+    WHERE timestamp BETWEEN ? AND ?
+"""
+
+CACHE_SIZE = 32
+_cache = OrderedDict()  # (start, end) -> (fingerprint, report), shared by the read pool
+_cache_lock = threading.Lock()
+
+
+def _register_functions(conn):
+    # same per line rounding as the invoice, so the return matches the bills line for line
+    conn.create_function("line_gross_paise", 2, totals.line_gross, deterministic=True)
+    conn.create_function("line_net_paise", 3, totals.line_net, deterministic=True)
+
+
+def _money(paise):
+    return paise / 100
+
+
+def build_report(cursor, start, end):
+    """Compute the report for timestamps in [start, end] ('yyyy-MM-dd HH:mm:ss' strings). Uses the cache when valid."""
+    cursor.execute(DOCUMENTS_QUERY, (start, end))
+    count, first, last, id_sum, gross_sum, latest = cursor.fetchone()
+    fingerprint = (count, id_sum, gross_sum, latest)
+
+    with _cache_lock:
+        cached = _cache.get((start, end))
+        if cached is not None and cached[0] == fingerprint:
+            _cache.move_to_end((start, end))
+            return cached[1]
+
+    _register_functions(cursor.connection)
+    cursor.execute(HSN_QUERY, (start, end))
+    hsn_rows = []
+    slabs = {}
+    for hsn, unit, tax_perc, description, quantity, total_value, taxable_value in cursor.fetchall():
+        cgst, sgst = totals.split_tax(total_value - taxable_value)
+        hsn_rows.append({
+            "hsn": hsn,
+            "description": description,
+            "unit": unit,
+            "tax_perc": tax_perc,
+            "quantity": round(quantity, 3),
+            "total_value": _money(total_value),
+            "taxable_value": _money(taxable_value),
+            "cgst": _money(cgst),
+            "sgst": _money(sgst),
+        })
+        slab = slabs.setdefault(tax_perc, [0, 0])
+        slab[0] += taxable_value
+        slab[1] += total_value
+
+    slab_rows = []
+    for tax_perc, (taxable_value, total_value) in sorted(slabs.items()):
+        cgst, sgst = totals.split_tax(total_value - taxable_value)
+        slab_rows.append({
+            "tax_perc": tax_perc,
+            "taxable_value": taxable_value,
+            "cgst": cgst,
+            "sgst": sgst,
+            "total_value": total_value,
+        })
+
+    report = {
+        "start": start,
+        "end": end,
+        "hsn": hsn_rows,
+        "slabs": [{column: _money(value) if column != "tax_perc" else value for column, value in row.items()} for row in slab_rows],
+        "totals": {
+            column: _money(sum(row[column] for row in slab_rows))
+            for column in ("taxable_value", "cgst", "sgst", "total_value")
+        },
+        # numbers missing from the series were deleted, GSTR-1 reports them as cancelled
+        "documents": {
+            "first": first,
+            "last": last,
+            "count": count,
+            "cancelled": (last - first + 1 - count) if count else 0,
+        },
+    }
+
+    with _cache_lock:
+        _cache[(start, end)] = (fingerprint, report)
+        _cache.move_to_end((start, end))
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return report
+
+
+def _write_csv(path, header, rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def export_gstr1(report, folder, invoice_prefix=""):
+    """Write hsn.csv, b2cs.csv and docs.csv in the GSTR-1 offline utility layout. Returns the file paths."""
+    os.makedirs(folder, exist_ok=True)
+    place_of_supply = GetConfig("place_of_supply", "")
+
+    hsn_path = os.path.join(folder, "hsn.csv")
+    _write_csv(hsn_path, [
+        "HSN", "Description", "UQC", "Total Quantity", "Total Value", "Rate", "Taxable Value",
+        "Integrated Tax Amount", "Central Tax Amount", "State/UT Tax Amount", "Cess Amount",
+    ], [
+        [row["hsn"], row["description"], row["unit"].upper(), row["quantity"], f"{row['total_value']:.2f}", row["tax_perc"],
+         f"{row['taxable_value']:.2f}", "0.00", f"{row['cgst']:.2f}", f"{row['sgst']:.2f}", "0.00"]
+        for row in report["hsn"]
+    ])
+
+    b2cs_path = os.path.join(folder, "b2cs.csv")
+    _write_csv(b2cs_path, [
+        "Type", "Place Of Supply", "Rate", "Applicable % of Tax Rate", "Taxable Value", "Cess Amount", "E-Commerce GSTIN",
+    ], [
+        ["OE", place_of_supply, row["tax_perc"], "", f"{row['taxable_value']:.2f}", "0.00", ""]
+        for row in report["slabs"]
+    ])
+
+    docs_path = os.path.join(folder, "docs.csv")
+    documents = report["documents"]
+    _write_csv(docs_path, ["Nature of Document", "Sr. No. From", "Sr. No. To", "Total Number", "Cancelled"], [
+        # numbered as printed on the invoice
+        ["Invoices for outward supply", f"{invoice_prefix}{documents['first']:03d}", f"{invoice_prefix}{documents['last']:03d}",
+         documents["count"] + documents["cancelled"], documents["cancelled"]]
+    ] if documents["count"] else [])
+
+    return [hsn_path, b2cs_path, docs_path]
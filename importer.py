@@ -0,0 +1,170 @@
+"""
+Bulk product import from supplier price lists (.csv or .xlsx).
+Rows are streamed, validated one by one and upserted by DataBase.import_products.
+Only the columns present in the file are written, so a list with just id, name and price updates prices
+without touching stock. Blank cells leave the current value alone.
+"""
+import csv
+import posixpath
+import zipfile
+import xml.etree.ElementTree as ET
+
+# product column -> accepted header spellings (compared lowercase)
+HEADER_ALIASES = {
+    "p_id": ["p_id", "id", "product id", "code", "item code"],
+    "p_name": ["p_name", "name", "product name", "item", "item name", "description of goods"],
+    "HSN": ["hsn", "hsn code", "hsn/sac"],
+    "price": ["price", "price per unit", "rate", "unit price", "mrp"],
+    "stock": ["stock", "product stock", "qty", "quantity"],
+    "unit": ["unit", "uom"],
+    "tax_perc": ["tax_perc", "tax", "tax%", "tax percentage", "gst", "gst%", "gst rate"],
+    "p_desc": ["p_desc", "desc", "description"],
+    "barcode": ["barcode", "ean", "upc"],
+}
+
+# used for new products when the file has no such column
+INSERT_DEFAULTS = {"HSN": "", "stock": 0.0, "unit": "", "tax_perc": 0.0, "p_desc": None, "barcode": None}
+
+XLSX_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+
+
+def _xlsx_first_sheet(archive):
+    workbook = ET.fromstring(archive.read("xl/workbook.xml"))
+    rel_id = workbook.find(f"{XLSX_NS}sheets/{XLSX_NS}sheet").get(f"{REL_NS}id")
+    rels = ET.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+    for rel in rels:
+        if rel.get("Id") == rel_id:
+            target = rel.get("Target")
+            return target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join("xl", target))
+    raise ValueError("workbook has no worksheet")
+
+
+def _xlsx_shared_strings(archive):
+    if "xl/sharedStrings.xml" not in archive.namelist():
+        return []
+    strings = []
+    with archive.open("xl/sharedStrings.xml") as f:
+        for _, elem in ET.iterparse(f):
+            if elem.tag == f"{XLSX_NS}si":
+                strings.append("".join(t.text or "" for t in elem.iter(f"{XLSX_NS}t")))
+                elem.clear()
+    return strings
+
+
+def _column_index(ref):
+    index = 0
+    for ch in ref:
+        if not ch.isalpha():
+            break
+        index = index * 26 + ord(ch.upper()) - ord("A") + 1
+    return index - 1
+
+
+def read_xlsx(path):
+    """Yield the first worksheet as lists of cell text, streaming the sheet XML."""
+    with zipfile.ZipFile(path) as archive:
+        shared = _xlsx_shared_strings(archive)
+        with archive.open(_xlsx_first_sheet(archive)) as f:
+            for _, elem in ET.iterparse(f):
+                if elem.tag != f"{XLSX_NS}row":
+                    continue
+                cells = []
+                for cell in elem.iter(f"{XLSX_NS}c"):
+                    kind = cell.get("t")
+                    if kind == "inlineStr":
+                        value = "".join(t.text or "" for t in cell.iter(f"{XLSX_NS}t"))
+                    else:
+                        v = cell.find(f"{XLSX_NS}v")
+                        value = "" if v is None or v.text is None else v.text
+                        if kind == "s" and value:
+                            value = shared[int(value)]
+                    column = _column_index(cell.get("r", "")) if cell.get("r") else len(cells)
+                    cells.extend([""] * (column - len(cells) + 1))
+                    cells[column] = value
+                yield cells
+                elem.clear()
+
+
+def read_csv(path):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        yield from csv.reader(f)
+
+
+def read_rows(path):
+    """Yield (line_no, {column: text}) for every data row of a .csv or .xlsx file, keyed by product column."""
+    reader = read_xlsx(path) if str(path).lower().endswith(".xlsx") else read_csv(path)
+    header = None
+    for line_no, cells in enumerate(reader, start=1):
+        if not any(str(cell).strip() for cell in cells):
+            continue
+        if header is None:
+            header = map_header(cells)
+            continue
+        yield line_no, {column: cells[i].strip() if i < len(cells) else "" for i, column in header.items()}
+
+
+def map_header(cells):
+    """{cell index: product column} for the header row. Raises ValueError when id, name or price is missing."""
+    lookup = {alias: column for column, aliases in HEADER_ALIASES.items() for alias in aliases}
+    header = {}
+    for i, cell in enumerate(cells):
+        column = lookup.get(str(cell).strip().lower())
+        if column and column not in header.values():
+            header[i] = column
+    missing = [column for column in ("p_id", "p_name", "price") if column not in header.values()]
+    if missing:
+        raise ValueError("import file has no column for " + ", ".join(missing))
+    return header
+
+
+def _number(text, column):
+    try:
+        return float(text.replace(",", ""))
+    except ValueError:
+        raise ValueError(f"{column} '{text}' is not a number")
+
+
+def product_id(record):
+    text = record["p_id"]
+    number = _number(text, "id")
+    if not number.is_integer() or number <= 0:
+        raise ValueError(f"id '{text}' is not a positive whole number")
+    return int(number)
+
+
+def validate(record, current, columns):
+    """
+    Convert one record to column values. Raises ValueError with a readable message.
+    Blank optional cells keep the value of current (the existing product row, None if new) or get the insert default.
+    """
+    old = dict(zip(columns, current)) if current is not None else INSERT_DEFAULTS
+    values = {}
+    for column, text in record.items():
+        if text == "" and column in INSERT_DEFAULTS:
+            values[column] = old[column]
+        elif column == "p_id":
+            values[column] = product_id(record)
+        elif column in ("price", "stock", "tax_perc"):
+            values[column] = _number(text, column)
+        elif column == "barcode":
+            # spreadsheets hand numeric barcodes back as floats
+            values[column] = text[:-2] if text.endswith(".0") else text
+        else:
+            values[column] = text
+
+    if not values["p_name"]:
+        raise ValueError("name is empty")
+    if values["price"] < 0:
+        raise ValueError("price is negative")
+    if not 0 <= values.get("tax_perc", 0) <= 100:
+        raise ValueError(f"tax {values['tax_perc']} is outside 0-100")
+    return values
+
+
+def diff(values, current, columns):
+    """{column: (old, new)} of the columns that change. current is the product row (None if new), columns its names."""
+    if current is None:
+        return {column: (None, value) for column, value in values.items()}
+    old = dict(zip(columns, current))
+    return {column: (old[column], value) for column, value in values.items() if old[column] != value}
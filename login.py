@@ -4,13 +4,13 @@ from PyQt6.QtCore import QObject, pyqtSignal as Signal, pyqtSlot as Slot, Qt, QP
 from PyQt6.QtWidgets import QApplication, QWidget, QLabel, QLineEdit, QPushButton, QVBoxLayout
 from PyQt6.QtWidgets import QFrame
 import sys
-from database import DataBase
+from dbworker import DbExecutor
 
 class LoginWindow(QWidget):
     def __init__(self, db):
         super().__init__()
         self.init_ui()
-        self.db : DataBase = db
+        self.db : DbExecutor = db
 
     def hash_password(self, password: str) -> str:
         """Hash password using bcrypt."""
@@ -30,9 +30,9 @@ class LoginWindow(QWidget):
             return False  # Username already exists
         return True
 
-    def check_login(self, username, password):
-        """Check login credentials."""
-        pw, role = self.db.get_user_data(username) or (None, None)
+    def check_login(self, username, password, user_data):
+        """Check login credentials against the user's row from get_user_data."""
+        pw, role = user_data or (None, None)
 
         if pw is None:
             self.label_status.setText("User does not exist.")
@@ -90,7 +90,10 @@ class LoginWindow(QWidget):
         username = self.input_username.text()
         password = self.input_password.text()
 
-        role = self.check_login(username, password)
+        self.db.call("get_user_data", username, callback=lambda user_data: self.finish_login(username, password, user_data))
+
+    def finish_login(self, username, password, user_data):
+        role = self.check_login(username, password, user_data)
         if role:
             self.parent().login(username, role)
 
@@ -0,0 +1,243 @@
+"""
+Versioned schema upgrades for existing sql.db files.
+PRAGMA user_version records the last migration applied; each one runs in its own write transaction.
+Migrations must be idempotent, databases from before this runner may already have some of the objects.
+"""
+import sqlite3
+
+from GlobalAccess import GetConfig, LogMsg
+from totals import recompute_bill_totals
+
+# trigram full text index over the product catalog, kept in sync by triggers
+PRODUCT_FTS_SQL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING fts5(
+        p_id, p_name, content='product', content_rowid='p_id', tokenize='trigram'
+    );""",
+    """CREATE TRIGGER IF NOT EXISTS product_fts_ai AFTER INSERT ON product BEGIN
+        INSERT INTO product_fts(rowid, p_id, p_name) VALUES (new.p_id, new.p_id, new.p_name);
+    END;""",
+    """CREATE TRIGGER IF NOT EXISTS product_fts_ad AFTER DELETE ON product BEGIN
+        INSERT INTO product_fts(product_fts, rowid, p_id, p_name) VALUES ('delete', old.p_id, old.p_id, old.p_name);
+    END;""",
+    """CREATE TRIGGER IF NOT EXISTS product_fts_au AFTER UPDATE OF p_id, p_name ON product BEGIN
+        INSERT INTO product_fts(product_fts, rowid, p_id, p_name) VALUES ('delete', old.p_id, old.p_id, old.p_name);
+        INSERT INTO product_fts(rowid, p_id, p_name) VALUES (new.p_id, new.p_id, new.p_name);
+    END;""",
+]
+
+
+def product_search_index(cursor):
+    # optional: builds without fts5/trigram fall back to LIKE search
+    cursor.execute("SAVEPOINT fts;")
+    try:
+        for statement in PRODUCT_FTS_SQL:
+            cursor.execute(statement)
+        # index rows that were added before the index existed
+        cursor.execute("INSERT INTO product_fts(product_fts) VALUES ('rebuild');")
+        cursor.execute("RELEASE fts;")
+    except sqlite3.OperationalError as e:
+        cursor.execute("ROLLBACK TO fts;")
+        cursor.execute("RELEASE fts;")
+        LogMsg("Product search index unavailable, falling back to LIKE search : " + str(e))
+
+
+def product_barcode(cursor):
+    cursor.execute("PRAGMA table_info(product)")
+    if "barcode" not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE product ADD COLUMN barcode TEXT;")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS product_barcode ON product(barcode) WHERE barcode <> '';")
+
+
+def invoice_sequence(cursor):
+    cursor.execute("CREATE TABLE IF NOT EXISTS invoice_seq (prefix TEXT PRIMARY KEY, next_no INTEGER NOT NULL) STRICT;")
+
+
+def bill_indexes(cursor):
+    # date range listing, covers SELECT * FROM bills
+    cursor.execute("CREATE INDEX IF NOT EXISTS bills_timestamp ON bills(timestamp, bill_id, creator);")
+    # lines of a bill with the summed columns, so the summary join never touches the table
+    cursor.execute("CREATE INDEX IF NOT EXISTS bill_items_bill ON bill_items(bill_id, p_id, p_name, quantity, unit_price);")
+    # per product history
+    cursor.execute("CREATE INDEX IF NOT EXISTS bill_items_product ON bill_items(p_id, bill_id, quantity, unit_price);")
+
+
+def daily_product_sales(cursor):
+    # per day and product sales, maintained by the save and delete transactions
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS daily_product_sales (
+            day TEXT NOT NULL,
+            p_id INTEGER NOT NULL,
+            p_name TEXT NOT NULL,
+            quantity REAL NOT NULL,
+            amount REAL NOT NULL,
+            PRIMARY KEY (day, p_id, p_name)
+        ) WITHOUT ROWID;
+    """)
+    cursor.execute("DELETE FROM daily_product_sales;")
+    cursor.execute("""
+        INSERT INTO daily_product_sales (day, p_id, p_name, quantity, amount)
+        SELECT date(b.timestamp), bi.p_id, bi.p_name, SUM(bi.quantity), SUM(bi.quantity * bi.unit_price)
+        FROM bill_items bi
+        JOIN bills b ON bi.bill_id = b.bill_id
+        GROUP BY date(b.timestamp), bi.p_id, bi.p_name;
+    """)
+
+
+BILL_TOTAL_COLUMNS = ["net_total", "tax_total", "gross_total", "round_off"]
+
+
+def backfill_bill_totals(cursor):
+    cursor.executemany(
+        "UPDATE bills SET net_total = ?, tax_total = ?, gross_total = ?, round_off = ? WHERE bill_id = ?;",
+        [(*totals, bill_id) for bill_id, totals in recompute_bill_totals(cursor).items()]
+    )
+
+
+def bill_totals(cursor):
+    cursor.execute("PRAGMA table_info(bills)")
+    columns = [row[1] for row in cursor.fetchall()]
+    for column in BILL_TOTAL_COLUMNS:
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE bills ADD COLUMN {column} REAL NOT NULL DEFAULT 0;")
+    backfill_bill_totals(cursor)
+    # listing with amounts stays an index only scan
+    cursor.execute("DROP INDEX IF EXISTS bills_timestamp;")
+    cursor.execute("CREATE INDEX IF NOT EXISTS bills_listing ON bills(timestamp, bill_id, creator, gross_total, round_off);")
+
+
+STOCK_LEDGER_SQL = [
+    """CREATE TABLE IF NOT EXISTS stock_movements (
+        move_id INTEGER PRIMARY KEY,
+        p_id INTEGER NOT NULL,
+        at TEXT NOT NULL DEFAULT (datetime('now','localtime')),
+        kind TEXT NOT NULL CHECK (kind IN ('opening', 'sale', 'void', 'receipt', 'adjustment')),
+        quantity REAL NOT NULL,
+        bill_id INTEGER,
+        note TEXT
+    );""",
+    "CREATE INDEX IF NOT EXISTS stock_movements_product ON stock_movements(p_id, move_id, at, quantity);",
+    # stock of a product after all its movements up to and including move_id
+    """CREATE TABLE IF NOT EXISTS stock_snapshots (
+        p_id INTEGER NOT NULL,
+        move_id INTEGER NOT NULL,
+        at TEXT NOT NULL,
+        stock REAL NOT NULL,
+        PRIMARY KEY (p_id, move_id)
+    ) WITHOUT ROWID;""",
+    # product.stock is a cache of the ledger; an opening movement records stock the product was created with
+    """CREATE TRIGGER IF NOT EXISTS stock_movements_apply AFTER INSERT ON stock_movements WHEN new.kind <> 'opening' BEGIN
+        UPDATE product SET stock = stock + new.quantity WHERE p_id = new.p_id;
+    END;""",
+    """CREATE TRIGGER IF NOT EXISTS stock_movements_no_update BEFORE UPDATE ON stock_movements BEGIN
+        SELECT RAISE(ABORT, 'stock_movements is append only');
+    END;""",
+    """CREATE TRIGGER IF NOT EXISTS stock_movements_no_delete BEFORE DELETE ON stock_movements BEGIN
+        SELECT RAISE(ABORT, 'stock_movements is append only');
+    END;""",
+]
+
+
+def stock_ledger(cursor):
+    for statement in STOCK_LEDGER_SQL:
+        cursor.execute(statement)
+    # history before the ledger is unknown, start every product from its current stock
+    cursor.execute("""
+        INSERT INTO stock_movements (p_id, kind, quantity, note)
+        SELECT p_id, 'opening', stock, 'ledger started' FROM product
+        WHERE p_id NOT IN (SELECT p_id FROM stock_movements);
+    """)
+
+
+# last change of each product, so every counter can refresh its in-memory catalog with what the others changed
+PRODUCT_CHANGES_SQL = [
+    "CREATE TABLE IF NOT EXISTS product_changes (p_id INTEGER PRIMARY KEY, seq INTEGER NOT NULL);",
+    "CREATE INDEX IF NOT EXISTS product_changes_seq ON product_changes(seq);",
+    """CREATE TRIGGER IF NOT EXISTS product_changes_ai AFTER INSERT ON product BEGIN
+        INSERT INTO product_changes (p_id, seq) SELECT new.p_id, IFNULL(MAX(seq), 0) + 1 FROM product_changes WHERE true
+        ON CONFLICT(p_id) DO UPDATE SET seq = excluded.seq;
+    END;""",
+    """CREATE TRIGGER IF NOT EXISTS product_changes_au AFTER UPDATE ON product BEGIN
+        INSERT INTO product_changes (p_id, seq) SELECT old.p_id, IFNULL(MAX(seq), 0) + 1 FROM product_changes WHERE true
+        ON CONFLICT(p_id) DO UPDATE SET seq = excluded.seq;
+        INSERT INTO product_changes (p_id, seq) SELECT new.p_id, IFNULL(MAX(seq), 0) + 1 FROM product_changes WHERE true
+        ON CONFLICT(p_id) DO UPDATE SET seq = excluded.seq;
+    END;""",
+    """CREATE TRIGGER IF NOT EXISTS product_changes_ad AFTER DELETE ON product BEGIN
+        INSERT INTO product_changes (p_id, seq) SELECT old.p_id, IFNULL(MAX(seq), 0) + 1 FROM product_changes WHERE true
+        ON CONFLICT(p_id) DO UPDATE SET seq = excluded.seq;
+    END;""",
+]
+
+
+def product_changes(cursor):
+    for statement in PRODUCT_CHANGES_SQL:
+        cursor.execute(statement)
+
+
+def bill_invoice_prefix(cursor):
+    cursor.execute("PRAGMA table_info(bills)")
+    if "invoice_prefix" not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE bills ADD COLUMN invoice_prefix TEXT NOT NULL DEFAULT '';")
+    # the prefix of older bills was never stored, the configured one is the best guess
+    cursor.execute("UPDATE bills SET invoice_prefix = ? WHERE invoice_prefix = '';", (GetConfig("invoice_prefix", "A"),))
+    # bill_id is one key for every prefix, so the counters become a single series
+    cursor.execute("""
+        UPDATE invoice_seq SET next_no = (
+            SELECT MAX(MAX(next_no), (SELECT IFNULL(MAX(bill_id), 0) + 1 FROM bills)) FROM invoice_seq
+        );
+    """)
+
+
+def stock_snapshot_mark(cursor):
+    # ledger rows up to move_id have been looked at by a snapshot pass, the next pass starts after it
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS stock_snapshot_mark (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            move_id INTEGER NOT NULL
+        );
+    """)
+    cursor.execute("INSERT OR IGNORE INTO stock_snapshot_mark (id, move_id) VALUES (1, 0);")
+
+
+# (version, description, step). Append only, never renumber.
+MIGRATIONS = [
+    (1, "product search index", product_search_index),
+    (2, "product barcode column", product_barcode),
+    (3, "invoice sequence table", invoice_sequence),
+    (4, "indexes for date range and per product queries", bill_indexes),
+    (5, "daily product sales rollup", daily_product_sales),
+    (6, "bill totals stored on bills", bill_totals),
+    (7, "stock movement ledger and snapshots", stock_ledger),
+    # totals are now computed in paise with half up rupee rounding
+    (8, "bill totals recomputed in paise", backfill_bill_totals),
+    (9, "product change log for catalog sync", product_changes),
+    (10, "invoice prefix stored on bills", bill_invoice_prefix),
+    (11, "stock snapshot pass mark", stock_snapshot_mark),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def migrate(db):
+    """Bring the schema of db (a read-write DataBase) up to LATEST_VERSION."""
+    cursor = db.cursor
+    cursor.execute("PRAGMA user_version;")
+    if cursor.fetchone()[0] >= LATEST_VERSION:
+        return
+
+    for version, description, step in MIGRATIONS:
+        # re-read under the write lock, another counter may have migrated meanwhile
+        db.begin_write()
+        try:
+            cursor.execute("PRAGMA user_version;")
+            if cursor.fetchone()[0] >= version:
+                db.conn.rollback()
+                continue
+            step(cursor)
+            cursor.execute(f"PRAGMA user_version = {version};")
+            db.conn.commit()
+        except Exception as e:
+            db.conn.rollback()
+            LogMsg(f"Database migration {version} ({description}) failed : {e}")
+            raise
+        LogMsg(f"Database upgraded to version {version}: {description}")
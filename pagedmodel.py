@@ -0,0 +1,80 @@
+"""
+Table models that load their rows from the database a page at a time as the view scrolls.
+"""
+from PyQt6.QtCore import Qt, QAbstractTableModel, QModelIndex
+
+from dbworker import DbExecutor
+
+
+class PagedTableModel(QAbstractTableModel):
+    """
+    Rows fetched with keyset pagination, no widget is created per row.
+    Subclasses set headers, page_query (the DataBase method returning one page after a key) and page_size,
+    and override page_args and row_key where the query needs them.
+    """
+    headers = []
+    page_query = None
+    page_size = 0
+
+    def __init__(self, db: DbExecutor, parent=None):
+        super().__init__(parent)
+        self.db: DbExecutor = db
+        self.rows = []
+        self.exhausted = True
+        self.loading = False
+        self.generation = 0  # pages requested before the last reset are dropped
+
+    def page_args(self):
+        """Arguments of page_query ahead of after."""
+        return ()
+
+    def row_key(self, row):
+        """The after key that continues the listing below row."""
+        return row
+
+    def reset(self):
+        self.beginResetModel()
+        self.rows = []
+        self.exhausted = False
+        self.loading = False
+        self.generation += 1
+        self.endResetModel()
+        self.fetchMore(QModelIndex())
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.headers[section]
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted and not self.loading
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+        self.loading = True
+        generation = self.generation
+        self.db.call(self.page_query, *self.page_args(), after=self.row_key(self.rows[-1]) if self.rows else None,
+                     callback=lambda page: self.append_page(generation, page),
+                     errback=lambda e: self.page_failed(generation))
+
+    def page_failed(self, generation):
+        # the error is logged, let the next scroll ask again
+        if generation == self.generation:
+            self.loading = False
+
+    def append_page(self, generation, page):
+        if generation != self.generation:
+            return
+        self.loading = False
+        self.exhausted = len(page) < self.page_size
+        if page:
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(page) - 1)
+            self.rows.extend(page)
+            self.endInsertRows()
@@ -0,0 +1,123 @@
+"""
+Batch reprint of saved invoices for audits: every bill in an id or date range is rendered with BillPrinter
+on a pool of worker processes, into one merged PDF or one PDF per invoice.
+"""
+import io
+import json
+import multiprocessing
+import os
+import sys
+from datetime import datetime
+
+# invoices per pool task. A merged chunk is one PDF with the header embedded once
+REPRINT_CHUNK_SIZE = 25
+
+BILLS_QUERY = """
+    SELECT b.bill_id, b.timestamp, b.invoice_prefix, bi.p_id, bi.p_name, bi.HSN, bi.unit_price, bi.quantity, bi.unit, bi.tax_perc
+    FROM bills b
+    JOIN bill_items bi ON bi.bill_id = b.bill_id
+    WHERE {where}
+    ORDER BY b.bill_id
+"""
+RANGE_FILTER = "b.timestamp BETWEEN ? AND ? AND b.bill_id BETWEEN ? AND ?"
+# the ids go in as one JSON array, a selection of any size is a single parameter
+IDS_FILTER = "b.bill_id IN (SELECT value FROM json_each(?))"
+
+
+class ReprintCancelled(Exception):
+    pass
+
+
+def load_bills(conn, start, end, first_id, last_id, bill_ids=None):
+    """[(bill_id, timestamp, invoice_prefix, items)] of the bills in both ranges, or in bill_ids, by invoice number."""
+    if bill_ids is not None:
+        rows = conn.execute(BILLS_QUERY.format(where=IDS_FILTER), (json.dumps([int(bill_id) for bill_id in bill_ids]),))
+    else:
+        rows = conn.execute(BILLS_QUERY.format(where=RANGE_FILTER), (start, end, first_id, last_id))
+    bills = []
+    for bill_id, timestamp, invoice_prefix, *item in rows:
+        if not bills or bills[-1][0] != bill_id:
+            bills.append((bill_id, timestamp, invoice_prefix, []))
+        bills[-1][3].append(tuple(item))
+    return bills
+
+
+def render_chunk(task):
+    """Pool worker. Returns [(file name, PDF bytes)], a single merged PDF when merge is set."""
+    from Printer import BillPrinter, render_bills
+    bills, merge = task
+    printers = [
+        BillPrinter(bill_id, datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S"), items, invoice_prefix=invoice_prefix)
+        for bill_id, timestamp, invoice_prefix, items in bills
+    ]
+    if merge:
+        return [(None, render_bills(printers))]
+    return [(f"{printer.invoice_prefix}{printer.invoice_no:03d}.pdf", printer.render()) for printer in printers]
+
+
+def reprint(conn, path, start, end, first_id=0, last_id=sys.maxsize, merge=True, progress=None, processes=None,
+            bill_ids=None):
+    """
+    Render the bills with timestamps in [start, end] and ids in [first_id, last_id], or exactly the bills in bill_ids.
+    merge writes one PDF to path, otherwise path is a folder that gets one PDF per invoice.
+    progress(done, total) is called as invoices finish; returning False cancels and removes what was written.
+    Returns the number of invoices and the bytes written.
+    """
+    bills = load_bills(conn, start, end, first_id, last_id, bill_ids)
+    total = len(bills)
+    if progress is not None and progress(0, total) is False:
+        raise ReprintCancelled("reprint cancelled")
+    if not total:
+        return 0, 0
+
+    if merge:
+        from pypdf import PdfReader, PdfWriter
+        writer = PdfWriter()
+    else:
+        os.makedirs(path, exist_ok=True)
+    written = []
+    tasks = [(bills[i:i + REPRINT_CHUNK_SIZE], merge) for i in range(0, total, REPRINT_CHUNK_SIZE)]
+    processes = max(1, min(processes or (os.cpu_count() or 2) - 1, len(tasks)))
+
+    done = 0
+    try:
+        # spawn, the pool must not inherit Qt or sqlite state from this process
+        with multiprocessing.get_context("spawn").Pool(processes) as pool:
+            for task, results in zip(tasks, pool.imap(render_chunk, tasks)):
+                for name, data in results:
+                    if merge:
+                        writer.append(PdfReader(io.BytesIO(data)))
+                    else:
+                        written.append(os.path.join(path, name))
+                        with open(written[-1], "wb") as f:
+                            f.write(data)
+                done += len(task[0])
+                if progress is not None and progress(done, total) is False:
+                    raise ReprintCancelled(f"reprint cancelled after {done} of {total} invoices")
+        if merge:
+            # every chunk carries its own copy of the header image, keep one
+            writer.compress_identical_objects()
+            with open(path, "wb") as f:
+                writer.write(f)
+            written.append(path)
+    except BaseException:
+        for file_path in written:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        raise
+    return total, sum(os.path.getsize(file_path) for file_path in written)
+
+
+if __name__ == '__main__':
+    # python reprint.py dates 2025-04-01 2025-04-30 april.pdf
+    # python reprint.py ids 100 250 invoices/        (a path without .pdf gets one file per invoice)
+    import sqlite3
+    mode, low, high, out_path = sys.argv[1:5]
+    conn = sqlite3.connect("file:database/sql.db?mode=ro", uri=True)
+    if mode == "dates":
+        bounds = dict(start=f"{low} 00:00:00", end=f"{high} 23:59:59")
+    else:
+        bounds = dict(start="1970-01-01 00:00:00", end="9999-12-31 23:59:59", first_id=int(low), last_id=int(high))
+    count, size = reprint(conn, out_path, merge=out_path.lower().endswith(".pdf"),
+                    progress=lambda done, total: print(f"\r{done}/{total}", end="", flush=True), **bounds)
+    print(f"\n{count} invoices written to {out_path}, {size / 1024:.0f} KB" + (f", {size / count / 1024:.1f} KB per invoice" if count else ""))
@@ -0,0 +1,283 @@
+"""
+Background print spooler. The GUI queues a bill and carries on, a worker process renders and prints it.
+
+Jobs are JSON files in the spool directory, written before they are queued and removed once printed,
+so jobs still pending when the app closes or crashes are printed on the next start.
+Jobs that keep failing are moved to the failed/ subdirectory together with their rendered output.
+"""
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import shutil
+import subprocess
+import threading
+import time
+from datetime import datetime
+
+from PyQt6.QtCore import QObject, pyqtSignal
+
+import ThermalPrinter
+from GlobalAccess import GetConfig, LogMsg, resource_path
+
+DEFAULT_SPOOL = {
+    "backend": "",        # ghostscript, lp, file or thermal. empty picks ghostscript on windows and lp elsewhere
+    "printer": "",        # printer name, empty for the default printer
+    "dir": "spool",
+    "retries": 3,
+    "retry_delay_ms": 3000,
+    "timeout_s": 60,
+    "sink_dir": "printed",  # where the file backend puts finished PDFs
+}
+
+
+def GetSpoolConfig():
+    config = {**DEFAULT_SPOOL, **GetConfig("print_spool", {})}
+    if not config["backend"]:
+        config["backend"] = "ghostscript" if platform.system() == "Windows" else "lp"
+    # read here, the worker process is handed everything it needs
+    config["thermal"] = ThermalPrinter.GetThermalConfig()
+    return config
+
+
+class PdfBackend:
+    """Prints the A4 invoice, two copies per sheet."""
+    extension = ".pdf"
+
+    def render(self, invoice_no, date_time, bill_items, invoice_prefix=None):
+        from Printer import BillPrinter
+        return BillPrinter(invoice_no, date_time, bill_items, invoice_prefix=invoice_prefix).render()
+
+
+class GhostscriptBackend(PdfBackend):
+    """gsprint with the bundled Ghostscript, the Windows setup."""
+
+    def __init__(self, config):
+        self.printer = config["printer"]
+        self.timeout = config["timeout_s"]
+
+    def print_file(self, path):
+        cmd = [resource_path("gsprint.exe"), "-ghostscript", resource_path("bin\\gswin32c.exe")]
+        if self.printer:
+            cmd += ["-printer", self.printer]
+        subprocess.run(cmd + [path], check=True, capture_output=True, timeout=self.timeout)
+
+
+class LpBackend(PdfBackend):
+    """CUPS through lp."""
+
+    def __init__(self, config):
+        self.printer = config["printer"]
+        self.timeout = config["timeout_s"]
+
+    def print_file(self, path):
+        cmd = ["lp"] + (["-d", self.printer] if self.printer else [])
+        subprocess.run(cmd + [path], check=True, capture_output=True, timeout=self.timeout)
+
+
+class FileBackend(PdfBackend):
+    """Copies the PDF into sink_dir instead of printing, for tests and setups without a printer."""
+
+    def __init__(self, config):
+        self.sink_dir = config["sink_dir"]
+        os.makedirs(self.sink_dir, exist_ok=True)
+
+    def print_file(self, path):
+        shutil.copy(path, os.path.join(self.sink_dir, os.path.basename(path)))
+
+
+class ThermalBackend:
+    """ESC/POS receipt sent straight to a thermal printer over usb, serial or network."""
+    extension = ".bin"
+
+    def __init__(self, config):
+        self.config = config["thermal"]
+
+    def render(self, invoice_no, date_time, bill_items, invoice_prefix=None):
+        return ThermalPrinter.ThermalBillPrinter(invoice_no, date_time, bill_items, self.config, invoice_prefix).render()
+
+    def print_file(self, path):
+        with open(path, "rb") as f:
+            ThermalPrinter.send(f.read(), self.config)
+
+
+BACKENDS = {"ghostscript": GhostscriptBackend, "lp": LpBackend, "file": FileBackend, "thermal": ThermalBackend}
+
+
+def _job_path(spool_dir, job_id):
+    return os.path.join(spool_dir, job_id + ".json")
+
+
+def _write_job(spool_dir, job):
+    # write then rename, a crash never leaves half a job behind
+    path = _job_path(spool_dir, job["job_id"])
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(job, f)
+    os.replace(path + ".tmp", path)
+
+
+def pending_jobs(spool_dir):
+    """Ids of the jobs waiting in spool_dir, oldest first."""
+    return sorted(name[:-5] for name in os.listdir(spool_dir) if name.endswith(".json"))
+
+
+def spool_worker(config, jobs, events):
+    """
+    Worker process: render and print job ids from jobs until None arrives.
+    Reports (state, job_id, invoice_no, detail) tuples on events, state being printing, printed, retry or failed.
+    The detail of printed is the size of the spooled file.
+    """
+    spool_dir = config["dir"]
+    backend = BACKENDS[config["backend"]](config)
+    retry_delay = config["retry_delay_ms"] / 1000
+    waiting = []  # (due, job_id) of jobs to retry
+
+    while True:
+        timeout = None
+        if waiting:
+            timeout = max(0, min(waiting)[0] - time.monotonic())
+        try:
+            job_id = jobs.get(timeout=timeout)
+        except queue.Empty:
+            due = min(waiting)
+            waiting.remove(due)
+            job_id = due[1]
+        if job_id is None:
+            # leave retries for the next start rather than holding up the exit
+            break
+
+        try:
+            with open(_job_path(spool_dir, job_id), encoding="utf-8") as f:
+                job = json.load(f)
+        except (OSError, ValueError) as e:
+            events.put(("failed", job_id, None, f"unreadable job : {e}"))
+            continue
+
+        invoice_no = job["invoice_no"]
+        output_path = os.path.join(spool_dir, job_id + backend.extension)
+        events.put(("printing", job_id, invoice_no, ""))
+        try:
+            if not os.path.exists(output_path):
+                # jobs spooled before the prefix was recorded have none
+                data = backend.render(invoice_no, datetime.fromisoformat(job["date_time"]), job["items"], job.get("invoice_prefix"))
+                with open(output_path, "wb") as f:
+                    f.write(data)
+            backend.print_file(output_path)
+        except Exception as e:
+            job["attempts"] += 1
+            error = str(e) or type(e).__name__
+            if job["attempts"] <= config["retries"]:
+                _write_job(spool_dir, job)
+                waiting.append((time.monotonic() + retry_delay * job["attempts"], job_id))
+                events.put(("retry", job_id, invoice_no, error))
+            else:
+                failed_dir = os.path.join(spool_dir, "failed")
+                os.makedirs(failed_dir, exist_ok=True)
+                for path in (output_path, _job_path(spool_dir, job_id)):
+                    if os.path.exists(path):
+                        os.replace(path, os.path.join(failed_dir, os.path.basename(path)))
+                events.put(("failed", job_id, invoice_no, error))
+            continue
+
+        size = os.path.getsize(output_path)
+        os.remove(output_path)
+        os.remove(_job_path(spool_dir, job_id))
+        events.put(("printed", job_id, invoice_no, f"{size / 1024:.0f} KB"))
+
+
+class PrintSpooler(QObject):
+    """
+    Queues bills for the spool worker process. Status changes arrive as job_status(job_id, invoice_no, state, detail)
+    on the GUI thread and are shown on the status bar.
+    """
+    job_status = pyqtSignal(str, int, str, str)
+
+    _instance = None
+
+    @classmethod
+    def I(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.config = GetSpoolConfig()
+        self.process = None
+        self.lock = threading.Lock()
+        self.job_status.connect(self._log_status)
+
+    def start(self):
+        """Start the worker process, or restart it if it died, and requeue the jobs waiting in the spool directory."""
+        with self.lock:
+            if self.process is not None:
+                if self.process.is_alive():
+                    return
+                # the worker died, start over from the spool directory
+                LogMsg("Print spooler stopped unexpectedly, restarting")
+                self.events.put(None)
+            os.makedirs(self.config["dir"], exist_ok=True)
+            # spawn on every platform, the worker must not inherit Qt state
+            context = multiprocessing.get_context("spawn")
+            self.jobs = context.Queue()
+            self.events = context.Queue()
+            self.process = context.Process(
+                target=spool_worker, args=(self.config, self.jobs, self.events), name="print-spooler", daemon=True
+            )
+            self.process.start()
+            self.listener = threading.Thread(target=self._listen, name="print-spooler-events", daemon=True)
+            self.listener.start()
+
+            leftover = pending_jobs(self.config["dir"])
+            for job_id in leftover:
+                self.jobs.put(job_id)
+        if leftover:
+            LogMsg(f"Printing {len(leftover)} bills left in the print queue")
+
+    def submit(self, invoice_no, date_time, bill_items, invoice_prefix=None):
+        """Queue a bill for printing and return its job id right away."""
+        self.start()
+        job_id = f"{time.time_ns()}-{invoice_no}"
+        _write_job(self.config["dir"], {
+            "job_id": job_id,
+            "invoice_no": invoice_no,
+            "invoice_prefix": invoice_prefix,
+            "date_time": date_time.isoformat(sep=" "),
+            "items": [list(item) for item in bill_items],
+            "attempts": 0,
+        })
+        self.jobs.put(job_id)
+        self.job_status.emit(job_id, invoice_no, "queued", "")
+        return job_id
+
+    def _listen(self):
+        while True:
+            event = self.events.get()
+            if event is None:
+                return
+            state, job_id, invoice_no, detail = event
+            self.job_status.emit(job_id, invoice_no or 0, state, detail)
+
+    def _log_status(self, job_id, invoice_no, state, detail):
+        if state == "queued":
+            LogMsg(f"Bill {invoice_no} sent to the printer")
+        elif state == "retry":
+            LogMsg(f"Printing bill {invoice_no} failed, retrying : {detail}")
+        elif state == "failed":
+            LogMsg(f"Could not print bill {invoice_no}, saved in {os.path.join(self.config['dir'], 'failed')} : {detail}")
+        elif state == "printed":
+            LogMsg(f"Bill {invoice_no} printed ({detail})")
+
+    def shutdown(self, timeout=10):
+        """Give the worker timeout seconds to print what is queued. Anything left stays in the spool directory for the next start."""
+        with self.lock:
+            if self.process is None:
+                return
+            self.jobs.put(None)
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.events.put(None)
+            self.listener.join()
+            self.process = None
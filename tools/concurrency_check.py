@@ -0,0 +1,40 @@
+"""
+Save bills from several processes at once against a scratch copy of the database, as several counters would.
+python tools/concurrency_check.py [database/sql.db] exits 1 if any save failed or two saves got the same invoice no.
+"""
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+
+# run from anywhere, the app modules live one level up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import DataBase
+from GlobalAccess import GlobalData
+
+
+def save_worker(db_path, bills):
+    GlobalData.I().SetUser("concurrency-check", "user")
+    db = DataBase(db_path)
+    items = [(p_id, p_name, HSN, price, 1.0, unit, tax_perc) for p_id, p_name, HSN, price, stock, unit, tax_perc, *rest in db.getProducts()[:3]]
+    return [db.save_bill(items) for _ in range(bills)]
+
+
+def concurrent_save_check(db_path, processes=3, bills=50):
+    """Returns True if every save succeeded with its own invoice no."""
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.starmap(save_worker, [(db_path, bills)] * processes)
+    invoice_nos = [invoice_no for result in results for invoice_no in result]
+    failed = invoice_nos.count(None)
+    unique = len(set(invoice_nos) - {None})
+    print(f"{len(invoice_nos)} saves from {processes} processes: {failed} failed, {unique} unique invoice nos")
+    return failed == 0 and unique == len(invoice_nos)
+
+
+if __name__ == '__main__':
+    # never the live database
+    scratch_path = os.path.join(tempfile.mkdtemp(), "sql.db")
+    shutil.copy(sys.argv[1] if len(sys.argv) > 1 else 'database/sql.db', scratch_path)
+    sys.exit(0 if concurrent_save_check(scratch_path) else 1)
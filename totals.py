@@ -0,0 +1,126 @@
+"""
+Bill totals in integer paise. Every screen, printout and report takes its numbers from here so they always agree.
+Prices include tax: each line's gross is rounded to the paisa, its taxable value is backed out of that and
+the tax is the difference, so the lines add up exactly to the bill totals.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
+from typing import NamedTuple
+
+
+def to_paise(rupees):
+    return int((Decimal(repr(float(rupees))) * 100).to_integral_value(ROUND_HALF_UP))
+
+
+def rupees(paise):
+    """'1234.50' for 123450 paise."""
+    sign = "-" if paise < 0 else ""
+    return f"{sign}{abs(paise) // 100}.{abs(paise) % 100:02d}"
+
+
+def _div_half_up(numerator, denominator):
+    sign = -1 if numerator < 0 else 1
+    return sign * ((2 * abs(numerator) + denominator) // (2 * denominator))
+
+
+def _tax_basis(tax_perc):
+    # 10000 + tax in basis points, the divisor that backs the tax out of a price
+    return 10000 + int((Decimal(repr(float(tax_perc))) * 100).to_integral_value(ROUND_HALF_UP))
+
+
+def line_gross(unit_price, quantity):
+    """Paise charged for a line, price times quantity rounded to the paisa."""
+    return int((to_paise(unit_price) * Decimal(repr(float(quantity)))).to_integral_value(ROUND_HALF_UP))
+
+
+def line_net(unit_price, quantity, tax_perc):
+    """Taxable value of a line in paise."""
+    return _div_half_up(line_gross(unit_price, quantity) * 10000, _tax_basis(tax_perc))
+
+
+def split_tax(tax):
+    """(cgst, sgst) halves of an intra-state tax in paise, the odd paisa goes to CGST."""
+    cgst = _div_half_up(tax, 2)
+    return cgst, tax - cgst
+
+
+class LineTotals(NamedTuple):
+    p_id: int
+    name: str
+    hsn: str
+    quantity: float
+    unit: str
+    tax_perc: float
+    unit_price: int  # paise, tax inclusive
+    unit_net: int    # paise, tax exclusive, for display only
+    net: int
+    tax: int
+    gross: int
+
+
+class BillTotals(NamedTuple):
+    lines: tuple
+    net: int
+    tax: int
+    gross: int
+    round_off: int
+
+    @property
+    def payable(self):
+        return self.gross + self.round_off
+
+    @property
+    def cgst(self):
+        return split_tax(self.tax)[0]
+
+    @property
+    def sgst(self):
+        return split_tax(self.tax)[1]
+
+    @property
+    def has_tax(self):
+        return any(line.tax_perc != 0 for line in self.lines)
+
+
+@lru_cache(maxsize=64)
+def _compute(items):
+    lines = []
+    net = tax = gross = 0
+    for p_id, p_name, HSN, unit_price, quantity, unit, tax_perc in items:
+        basis = _tax_basis(tax_perc)
+        price = to_paise(unit_price)
+        line_gross_paise = line_gross(unit_price, quantity)
+        line_net_paise = _div_half_up(line_gross_paise * 10000, basis)
+        lines.append(LineTotals(
+            p_id, p_name, HSN, quantity, unit, tax_perc, price, _div_half_up(price * 10000, basis),
+            line_net_paise, line_gross_paise - line_net_paise, line_gross_paise
+        ))
+        net += line_net_paise
+        tax += line_gross_paise - line_net_paise
+        gross += line_gross_paise
+    # the amount collected is rounded to the rupee, half up
+    return BillTotals(tuple(lines), net, tax, gross, _div_half_up(gross, 100) * 100 - gross)
+
+
+def compute_totals(items):
+    """
+    BillTotals of bill lines shaped like curr_bill rows, money in integer paise.
+    Results are cached, so showing and then printing the same bill computes it once.
+    """
+    return _compute(tuple(tuple(item) for item in items))
+
+
+def bill_totals(items):
+    """(net, tax, gross, round_off) in rupees, as stored on bills."""
+    totals = compute_totals(items)
+    return totals.net / 100, totals.tax / 100, totals.gross / 100, totals.round_off / 100
+
+
+def recompute_bill_totals(cursor):
+    """Recompute totals from bill_items. Returns {bill_id: totals}, bills without lines are left out."""
+    cursor.execute("SELECT bill_id, p_id, p_name, HSN, unit_price, quantity, unit, tax_perc FROM bill_items ORDER BY bill_id;")
+
+    lines = {}
+    for row in cursor.fetchall():
+        lines.setdefault(row[0], []).append(row[1:])
+    return {bill_id: bill_totals(items) for bill_id, items in lines.items()}
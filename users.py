@@ -7,14 +7,14 @@ from PyQt6.QtWidgets import (
 from PyQt6.QtCore import Qt
 from PyQt6.QtGui import QAction
 from bcrypt import hashpw, gensalt
-from database import DataBase
+from dbworker import DbExecutor
 
 from GlobalAccess import LogMsg
 
 class UserManagement(QWidget):
     def __init__(self, db):
         super().__init__()
-        self.db:DataBase = db
+        self.db:DbExecutor = db
         self.setWindowTitle("User Management")
         self.setGeometry(100, 100, 600, 400)
         
@@ -64,8 +64,10 @@ class UserManagement(QWidget):
         self.setLayout(layout)
 
     def load_users(self):
+        self.db.call("get_users", callback=self.show_users)
+
+    def show_users(self, users):
         self.table.setRowCount(0)
-        users = self.db.get_users()
         for row_number, user in enumerate(users):
             id, name, pwhash, role = user
             self.table.insertRow(row_number)
@@ -84,9 +86,8 @@ class UserManagement(QWidget):
             LogMsg("Passwords do not match")
             return
         
-        self.db.add_user(username, password, role)
+        self.db.call("add_user", username, password, role, callback=lambda _: self.load_users())
         
-        self.load_users()
         self.username_input.clear()
         self.password_input.clear()
         self.conf_password_input.clear()
@@ -105,9 +106,7 @@ class UserManagement(QWidget):
         
         user_id = self.table.item(selected_row, 0).text()
         
-        self.db.delete_user(user_id)
-        
-        self.load_users()
+        self.db.call("delete_user", user_id, callback=lambda _: self.load_users())
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)